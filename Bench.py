@@ -0,0 +1,189 @@
+import argparse
+import fnmatch
+import json
+import math
+import os
+import platform
+import sys
+import time
+import timeit
+
+# results go to stdout as json
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+import pygame
+
+from Narrator import Narrator, Poly, offsetOutline, evaluateRig, scaling, translation
+
+VERTEX_COUNTS = (4, 64, 1024)
+RESOLUTIONS = ((256, 256), (800, 800), (1920, 1080))
+
+def circle(n, r = 1.):
+    a = np.arange(n) * (2 * math.pi / n)
+    return np.stack((np.cos(a), np.sin(a)), axis=-1) * r
+
+def benchPolyRotate(n):
+    poly = Poly(circle(n))
+    return lambda: poly.rotate(.01).points
+
+def benchPolyScale(n):
+    poly = Poly(circle(n), (1, 2))
+    return lambda: poly.scale(1.0001).points
+
+def benchPolyDraw(n, outline):
+    display = pygame.Surface((800, 800))
+    poly = Poly(circle(n, 2.), color = (200, 200, 200))
+    poly.outline = .08 if outline else 0
+    view = scaling(80) @ translation((5, 5))
+    return lambda: poly.draw(display, view)
+
+def benchOutline(n):
+    points = circle(n, 2.)
+    return lambda: offsetOutline(points, .08, .25 / 80)
+
+def benchSetMouth():
+    narrator = Narrator(headless = True)
+    def run():
+        narrator.smile_amt = -narrator.smile_amt + .5
+        narrator.setMouth()
+    return run
+
+def benchUpdate(idle):
+    narrator = Narrator(headless = True)
+    narrator.update()
+    def run():
+        if not idle:
+            narrator.markDirty()
+        narrator.update()
+    return run
+
+def benchFrame(size, backend = "pygame", aa = 1):
+    narrator = Narrator(headless = True, size = size, backend = backend, aa = aa)
+    def run():
+        narrator.head_rotation = -narrator.head_rotation + .1
+        narrator.update()
+        narrator.draw()
+    return run
+
+def benchBlink(size, idle = False):
+    # one eye changing redraws its box, nothing changing redraws nothing
+    narrator = Narrator(headless = True, size = size)
+    narrator.update()
+    narrator.draw()
+    def run():
+        if not idle:
+            narrator.eye_openess[0] = 1.1 - narrator.eye_openess[0]
+        narrator.update()
+        narrator.draw()
+    return run
+
+def benchEvaluateRig(frames):
+    narrator = Narrator(headless = True)
+    values = np.array(narrator.getFacialValues()) + np.random.default_rng(0).uniform(-.2, .2, (frames, 14))
+    return lambda: evaluateRig(narrator, values)
+
+def getBenchmarks():
+    benchmarks = []
+    for n in VERTEX_COUNTS:
+        benchmarks.append(("poly.rotate[%d]" % n, lambda n=n: benchPolyRotate(n)))
+        benchmarks.append(("poly.scale[%d]" % n, lambda n=n: benchPolyScale(n)))
+        benchmarks.append(("poly.draw[%d]" % n, lambda n=n: benchPolyDraw(n, False)))
+        benchmarks.append(("poly.draw_outlined[%d]" % n, lambda n=n: benchPolyDraw(n, True)))
+        benchmarks.append(("outline.offset[%d]" % n, lambda n=n: benchOutline(n)))
+
+    benchmarks.append(("narrator.setMouth", benchSetMouth))
+    benchmarks.append(("narrator.update", lambda: benchUpdate(False)))
+    benchmarks.append(("narrator.update_idle", lambda: benchUpdate(True)))
+
+    for size in RESOLUTIONS:
+        benchmarks.append(("frame[%dx%d]" % size, lambda size=size: benchFrame(size)))
+        benchmarks.append(("frame.numpy[%dx%d]" % size, lambda size=size: benchFrame(size, "numpy")))
+        benchmarks.append(("frame.numpy_aa[%dx%d]" % size, lambda size=size: benchFrame(size, "numpy", 4)))
+        benchmarks.append(("frame.blink[%dx%d]" % size, lambda size=size: benchBlink(size)))
+        benchmarks.append(("frame.idle[%dx%d]" % size, lambda size=size: benchBlink(size, True)))
+
+    for frames in (1, 1000):
+        benchmarks.append(("evaluateRig[%d]" % frames, lambda frames=frames: benchEvaluateRig(frames)))
+
+    return benchmarks
+
+def timeCall(call, repeats = 5, target = .02):
+    # grow the number of calls per repeat until one repeat takes target seconds
+    number = 1
+    while timeit.timeit(call, number = number) < target and number < 1 << 20:
+        number *= 2
+
+    per_call = np.array(timeit.repeat(call, number = number, repeat = repeats)) / number
+    return {"number": number,
+            "repeats": repeats,
+            "min_us": float(per_call.min() * 1e6),
+            "median_us": float(np.median(per_call) * 1e6)}
+
+def getMeta():
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pygame": pygame.version.ver,
+            "machine": platform.machine(),
+            "platform": platform.platform()}
+
+def run(pattern = "*", repeats = 5, target = .02, log = sys.stderr):
+    results = {}
+    for name, setup in getBenchmarks():
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        results[name] = timeCall(setup(), repeats, target)
+        if log:
+            print("%-28s %12.2f us" % (name, results[name]["median_us"]), file = log)
+
+    return {"meta": getMeta(), "results": results}
+
+def compare(old, new, threshold = .1):
+    # the benchmarks whose median got more than threshold slower
+    regressions = []
+    for name, result in new["results"].items():
+        if name not in old["results"]:
+            continue
+        before = old["results"][name]["median_us"]
+        after = result["median_us"]
+        change = (after - before) / before
+        print("%-28s %12.2f -> %12.2f us %+7.1f%%" % (name, before, after, change * 100))
+        if change > threshold:
+            regressions.append(name)
+
+    return regressions
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog = "bench", description = "headless narrator benchmarks")
+    parser.add_argument("-o", "--out", help = "write the results as json to this file")
+    parser.add_argument("-k", "--filter", default = "*", help = "only run benchmarks matching this glob")
+    parser.add_argument("-r", "--repeats", type = int, default = 5)
+    parser.add_argument("--quick", action = "store_true", help = "shorter repeats, noisier numbers")
+    parser.add_argument("--compare", nargs = 2, metavar = ("OLD", "NEW"), help = "compare two result files")
+    parser.add_argument("--threshold", type = float, default = .1, help = "slowdown that counts as a regression")
+    args = parser.parse_args(args)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            old = json.load(f)
+        with open(args.compare[1]) as f:
+            new = json.load(f)
+        regressions = compare(old, new, args.threshold)
+        if regressions:
+            print("regressions: " + ", ".join(regressions))
+            return 1
+        return 0
+
+    results = run(args.filter, 3 if args.quick else args.repeats, .005 if args.quick else .02)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent = 2)
+    else:
+        json.dump(results, sys.stdout, indent = 2)
+        print()
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
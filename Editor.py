@@ -0,0 +1,215 @@
+import math
+import tkinter as tk
+
+from Narrator import FACIAL_FIELDS, FIELD_INDEX, FacialSnapshot, pygame
+from Profiler import profiler
+
+class Control(tk.Frame):
+    # the editor runs on tk's event loop, a slider change sets its one field and asks for a frame,
+    # all the changes that come in before tk is idle again are drawn in one frame, so an idle editor
+    # only wakes up to look at the window's events every event_time seconds
+    def __init__(self, narrator, master=None):
+        tk.Frame.__init__(self, master, width=768, height=576, bg="", colormap="new")
+        self.grid()
+        self.narrator = narrator
+        self.cont = 1
+        self.frame = None
+        self.preview = None
+        self.event_time = .1
+        self.createWidgets()
+
+        self.snap = FacialSnapshot()
+        self.snap.takeSnapshot(self.narrator)
+
+    def takeSnapshot(self):
+        self.snap = self.narrator.takeFacialSnapshot()
+
+    def applySnapshot(self):
+        self.narrator.addSnapshot(self.snap)
+
+    def quit(self):
+        self.cont = 0
+        tk.Frame.quit(self)
+
+    def setField(self, field, value):
+        value = float(value)
+        if value != self.narrator.getFacialValues()[FIELD_INDEX[field]]:
+            self.narrator.setFacialValue(field, value)
+            self.requestFrame()
+
+    def requestFrame(self):
+        if self.frame is None:
+            self.frame = self.after_idle(self.renderFrame)
+
+    def renderFrame(self):
+        self.frame = None
+        with profiler.stage("frame"):
+            self.narrator.update()
+            self.narrator.render()
+
+    def togglePreview(self):
+        # plays the keyframes from the start, stopping leaves the sliders at the pose it stopped on
+        if self.preview is None:
+            self.narrator.start()
+            self.narrator.seek(0)
+            self.narrator.dt = self.narrator.scheduler.step
+            self.previewFrame()
+        else:
+            self.after_cancel(self.preview)
+            self.preview = None
+            self.set_vals()
+
+    def previewFrame(self):
+        self.preview = None
+        if not self.cont:
+            return
+
+        for step in range(self.narrator.scheduler.tick()):
+            self.narrator.applySnapshots()
+        self.renderFrame()
+        self.preview = self.after(max(1, int(self.narrator.scheduler.frame_time * 1000)), self.previewFrame)
+
+    def pollEvents(self):
+        # the pygame window still has to take its events, a window that was uncovered is shown again
+        # without drawing the narrator
+        if not self.cont:
+            return
+
+        viewer = self.narrator.viewer
+        if not viewer.headless:
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.quit()
+                    return
+                if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                    viewer.dirty_rects = None
+                    viewer.render()
+
+        self.after(int(self.event_time * 1000), self.pollEvents)
+
+    def run(self):
+        self.cont = 1
+        self.narrator.start()
+        self.narrator.markDirty()
+        self.requestFrame()
+        self.pollEvents()
+        self.mainloop()
+
+    def createWidgets(self):
+
+        self.div0 = tk.Label(self, text = "\nHead" )
+
+        self.hr_scale = tk.Scale(self, from_=-math.pi / 2., to=math.pi / 2., orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.hr_label = tk.Label(self, text = "Head Rotation" )
+        self.he_scale = tk.Scale(self, from_=0, to=2, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.he_label = tk.Label(self, text = "Head Elavation" )
+        self.hs_scale = tk.Scale(self, from_=-1, to=1, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.hs_label = tk.Label(self, text = "Head Shift" )
+
+        self.div1 = tk.Label(self, text = "\nMouth" )
+
+        self.mw_scale = tk.Scale(self, from_=.05, to=.5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.mw_label = tk.Label(self, text = "Mouth Width" )
+        self.mh_scale = tk.Scale(self, from_=.05, to=.5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.mh_label = tk.Label(self, text = "Mouth Height" )
+        self.me_scale = tk.Scale(self, from_= .5, to= 1.5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.me_label = tk.Label(self, text = "Mouth Escalation" )
+        self.sa_scale = tk.Scale(self, from_= -2, to= 2, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.sa_label = tk.Label(self, text = "Smile Amt" )
+
+        self.div2 = tk.Label(self, text = "\nEyes" )
+
+        self.es_scale = tk.Scale(self, from_= .1, to= .5, orient=tk.HORIZONTAL, length = 400, resolution=0.001)
+        self.es_label =  tk.Label(self, text = "Eye Size" )
+        self.eor_scale = tk.Scale(self, from_= .1, to= 1.5, orient=tk.HORIZONTAL, length = 400, resolution=0.001)
+        self.eor_label = tk.Label(self, text = "Right Eye Openess" )
+        self.eol_scale = tk.Scale(self, from_= .1, to= 1.5, orient=tk.HORIZONTAL, length = 400, resolution=0.001)
+        self.eol_label = tk.Label(self, text = "Left Eye Openess" )
+
+        self.div3 = tk.Label(self, text = "\nEye Brows" )
+
+        self.ber_scale = tk.Scale(self, from_= 0, to= .5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.ber_label = tk.Label(self, text = "Right Eye Brow Escalation" )
+        self.bel_scale = tk.Scale(self, from_= 0, to= .5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
+        self.bel_label = tk.Label(self, text = "Left Eye Brow Escalation" )
+        self.brr_scale = tk.Scale(self, from_= -math.pi / 6., to= math.pi / 6., orient=tk.HORIZONTAL, length = 400, resolution=.01)
+        self.brr_label = tk.Label(self, text = "Right Eye Brow Rotation" )
+        self.brl_scale = tk.Scale(self, from_= math.pi / 6., to= -math.pi / 6., orient=tk.HORIZONTAL, length = 400, resolution=.01)
+        self.brl_label = tk.Label(self, text = "Left Eye Brow Rotation" )
+
+        self.div4 = tk.Label(self, text = "\n" )
+
+        self.applySnapshot = tk.Button(self, text='addSnapshot', command=self.applySnapshot)
+        self.takeSnapshot = tk.Button(self, text='takeSnapshot', command=self.takeSnapshot)
+        self.quitButton = tk.Button(self, text='Quit', command=self.quit)
+        self.previewButton = tk.Button(self, text='preview', command=self.togglePreview)
+
+        # in the order of FACIAL_FIELDS
+        self.scales = dict(zip(FACIAL_FIELDS, (self.hr_scale, self.he_scale, self.hs_scale, self.mw_scale,
+                                               self.mh_scale, self.me_scale, self.sa_scale, self.es_scale,
+                                               self.eor_scale, self.eol_scale, self.ber_scale, self.bel_scale,
+                                               self.brr_scale, self.brl_scale)))
+
+        self.div0.grid(row=0, column=1)
+
+        self.hr_scale.grid(row=1, column=1)
+        self.hr_label.grid(row=1, column=0)
+        self.he_scale.grid(row=2, column=1)
+        self.he_label.grid(row=2, column=0)
+        self.hs_scale.grid(row=3, column=1)
+        self.hs_label.grid(row=3, column=0)
+
+        self.div1.grid(row=4, column=1)
+
+        self.mw_scale.grid(row=5, column=1)
+        self.mw_label.grid(row=5, column=0)
+        self.mh_scale.grid(row=6, column=1)
+        self.mh_label.grid(row=6, column=0)
+        self.me_scale.grid(row=7, column=1)
+        self.me_label.grid(row=7, column=0)
+        self.sa_scale.grid(row=8, column=1)
+        self.sa_label.grid(row=8, column=0)
+
+        self.div2.grid(row=9, column=1)
+
+        self.es_scale.grid(row=10, column=1)
+        self.es_label.grid(row=10, column=0)
+        self.eor_scale.grid(row=11, column=1)
+        self.eor_label.grid(row=11, column=0)
+        self.eol_scale.grid(row=12, column=1)
+        self.eol_label.grid(row=12, column=0)
+
+        self.div3.grid(row=13, column=1)
+
+        self.ber_scale.grid(row=14, column=1)
+        self.ber_label.grid(row=14, column=0)
+        self.bel_scale.grid(row=15, column=1)
+        self.bel_label.grid(row=15, column=0)
+        self.brr_scale.grid(row=16, column=1)
+        self.brr_label.grid(row=16, column=0)
+        self.brl_scale.grid(row=17, column=1)
+        self.brl_label.grid(row=17, column=0)
+
+        self.div4.grid(row=18, column=0)
+
+        self.takeSnapshot.grid(row=19, column=0)
+        self.applySnapshot.grid(row=19, column=1)
+        self.quitButton.grid(row=19, column=2)
+        self.previewButton.grid(row=20, column=1)
+
+        self.set_vals()
+
+        # setField ignores the values the narrator already has, so setting the sliders to the
+        # narrator's values does not render anything
+        for field, scale in self.scales.items():
+            scale.configure(command=lambda value, field=field: self.setField(field, value))
+
+    def set_vals(self):
+        for field, value in zip(FACIAL_FIELDS, self.narrator.getFacialValues()):
+            self.scales[field].set(value)
+
+def edit(narrator):
+    if narrator.control is None:
+        narrator.control = Control(narrator)
+
+    narrator.control.run()
@@ -0,0 +1,196 @@
+import argparse
+import math
+import os
+import sys
+import timeit
+
+# the report goes to stdout
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+import numpy as np
+
+from Narrator import FACIAL_FIELDS, INTERPOLATIONS, Narrator
+from Render import surfaceToRGB
+from Visemes import compileTimeline, timeWords
+
+# the range of every field on the editor's sliders, the random poses are drawn from them
+FIELD_RANGES = {"hr": (-math.pi / 2., math.pi / 2.), "he": (0., 2.), "hs": (-1., 1.),
+                "mw": (.05, .5), "mh": (.05, .5), "me": (.5, 1.5), "sa": (-2., 2.),
+                "es": (.1, .5), "reo": (.1, 1.5), "leo": (.1, 1.5),
+                "rbe": (0., .5), "lbe": (0., .5), "rbr": (-math.pi / 6., math.pi / 6.), "lbr": (-math.pi / 6., math.pi / 6.)}
+
+SENTENCE = "The quick brown fox jumps over the lazy dog, while the queen watches."
+
+# the reference frames kept in the repository, checked when no file is given
+GOLDEN_DIR = os.path.dirname(os.path.abspath(__file__))
+GOLDEN_FILES = [os.path.join(GOLDEN_DIR, "golden.npz"), os.path.join(GOLDEN_DIR, "golden_numpy.npz")]
+
+def getPoses(count = 256, seed = 0, fps = 30):
+    # the labels and (n, 14) values of the poses the frames are rendered from, the neutral pose,
+    # every field at both ends of its range, count random poses and a compiled sentence played
+    # with every interpolation, the same for the same arguments on every machine
+    neutral = np.array(Narrator(headless = True, size = (1, 1)).getFacialValues(), dtype=np.float64)
+    labels = ["neutral"]
+    values = [neutral]
+
+    for i, field in enumerate(FACIAL_FIELDS):
+        for end, value in zip(("min", "max"), FIELD_RANGES[field]):
+            pose = neutral.copy()
+            pose[i] = value
+            labels.append("%s.%s" % (field, end))
+            values.append(pose)
+
+    low, high = np.array([FIELD_RANGES[field] for field in FACIAL_FIELDS]).T
+    random = np.random.default_rng(seed).uniform(low, high, (count, len(FACIAL_FIELDS)))
+    labels += ["random.%d" % i for i in range(count)]
+    values += list(random)
+
+    timeline = compileTimeline(timeWords([SENTENCE]), neutral)
+    times = np.arange(int(timeline.getDuration() * fps) + 1) / float(fps)
+    for mode in INTERPOLATIONS:
+        labels += ["%s.%d" % (mode, frame) for frame in range(len(times))]
+        values += list(timeline.evaluate(times, mode))
+
+    return labels, np.array(values)
+
+def renderPoses(values, size = (128, 128), backend = "pygame", aa = 1, fresh = False):
+    # the (n, h, w, 3) frames of every pose, drawn by one headless narrator in order, which only
+    # updates and redraws what changed since the pose before, or by a new narrator for every pose
+    # when fresh, so the frames do not depend on anything drawn before
+    narrator = Narrator(headless = True, size = size, backend = backend, aa = aa)
+    frames = np.empty((len(values), size[1], size[0], 3), dtype=np.uint8)
+    for frame, pose in zip(frames, values.tolist()):
+        if fresh:
+            narrator = Narrator(headless = True, size = size, backend = backend, aa = aa)
+        narrator.setFacialValues(pose)
+        narrator.update()
+        narrator.draw()
+        frame[...] = surfaceToRGB(narrator.viewer.display)
+    return frames
+
+def getHashes(frames, hash_size = 8):
+    # the difference hash of every frame as hash_size ** 2 bits packed into bytes, a bit is whether the
+    # brightness rises between two neighbouring cells of a hash_size x (hash_size + 1) grid of area
+    # means, so small shifts and antialiasing leave it alone while a moved part flips bits, the rows
+    # past the last whole band are left out so the bands are a reshape and one sum
+    count, h, w = frames.shape[:3]
+    height = (h // hash_size) * hash_size
+    bands = frames[:, :height].reshape((count, hash_size, -1, w * 3)).sum(axis=2, dtype=np.uint32)
+
+    columns = np.linspace(0, w, hash_size + 2).astype(np.int64)[:-1]
+    cells = np.add.reduceat(bands.reshape((count, hash_size, w, 3)), columns, axis=2) @ np.array([.299, .587, .114])
+    cells /= np.diff(np.append(columns, w))
+
+    bits = cells[:, :, 1:] > cells[:, :, :-1]
+    return np.packbits(bits.reshape((count, -1)), axis=1)
+
+def getHashDistances(a, b):
+    # the number of bits that differ between every pair of hashes
+    return np.unpackbits(a ^ b, axis=1).sum(axis=1)
+
+def compareFrames(frames, golden, tolerance = 2):
+    # the number of pixels of every frame with a channel more than tolerance off and the largest
+    # difference in every frame, frames equal to their golden ones are found with a compare of
+    # whole words and only the others are diffed
+    count = len(frames)
+    flat = frames.reshape((count, -1))
+    expected = golden.reshape((count, -1))
+    if flat.shape[1] % 8 == 0:
+        flat = flat.view(np.uint64)
+        expected = expected.view(np.uint64)
+
+    counts = np.zeros(count, dtype=np.int64)
+    largest = np.zeros(count, dtype=np.int64)
+    changed = np.flatnonzero(~np.all(flat == expected, axis=1))
+
+    # a chunk of frames at a time to bound the memory of the differences
+    chunk = max(1, (1 << 24) // max(1, frames[0].size))
+    for start in range(0, len(changed), chunk):
+        indexes = changed[start:start + chunk]
+        a = frames[indexes]
+        b = golden[indexes]
+        diff = np.maximum(a, b)
+        diff -= np.minimum(a, b)
+        off = (diff > tolerance).reshape((len(indexes), -1, 3))
+        counts[indexes] = (off[..., 0] | off[..., 1] | off[..., 2]).sum(axis=1)
+        largest[indexes] = diff.reshape((len(indexes), -1)).max(axis=1)
+
+    return counts, largest
+
+def record(file, size = (128, 128), backend = "pygame", aa = 1, count = 256, seed = 0):
+    # the reference frames are full renders of a new narrator, so a bug in the partial updates
+    # and redraws that check goes through can not end up in them
+    labels, values = getPoses(count, seed)
+    start = timeit.default_timer()
+    frames = renderPoses(values, size, backend, aa, fresh = True)
+    elapsed = timeit.default_timer() - start
+
+    with open(file, "wb") as f:
+        np.savez_compressed(f, labels = np.array(labels), values = values, frames = frames,
+                            hashes = getHashes(frames), backend = np.array(backend), aa = np.array(aa))
+    return len(frames), elapsed
+
+def check(file, tolerance = 2, max_pixels = 0, max_distance = 4):
+    # renders the stored poses again, a frame fails when its hash is more than max_distance bits from
+    # the golden one, which skips the pixel diff, or when more than max_pixels pixels are more than
+    # tolerance off, returns the failures as (label, hash distance, pixels, largest difference)
+    with np.load(file) as golden:
+        labels = golden["labels"].tolist()
+        values = golden["values"]
+        expected = golden["frames"]
+        hashes = golden["hashes"]
+        backend = str(golden["backend"])
+        aa = int(golden["aa"])
+
+    size = (expected.shape[2], expected.shape[1])
+    start = timeit.default_timer()
+    frames = renderPoses(values, size, backend, aa)
+    distances = getHashDistances(getHashes(frames), hashes)
+
+    close = np.flatnonzero(distances <= max_distance)
+    counts = np.full(len(frames), -1)
+    largest = np.full(len(frames), -1)
+    counts[close], largest[close] = compareFrames(frames[close], expected[close], tolerance)
+    elapsed = timeit.default_timer() - start
+
+    failed = (distances > max_distance) | (counts > max_pixels)
+    failures = [(labels[i], int(distances[i]), int(counts[i]), int(largest[i])) for i in np.flatnonzero(failed)]
+    return failures, len(frames), elapsed
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog = "golden", description = "golden frame regression checks")
+    parser.add_argument("mode", nargs = "?", choices = ("record", "check"), default = "check")
+    parser.add_argument("files", nargs = "*", help = "golden files, check takes the ones in the repository by default")
+    parser.add_argument("-s", "--size", default = "128x128", help = "WxH of recorded frames")
+    parser.add_argument("-b", "--backend", choices = ("pygame", "numpy"), default = "pygame")
+    parser.add_argument("--aa", type = int, default = 1)
+    parser.add_argument("-n", "--count", type = int, default = 256, help = "random poses to record")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("-t", "--tolerance", type = int, default = 2, help = "channel difference a pixel may have")
+    parser.add_argument("--max-pixels", type = int, default = 0, help = "pixels a frame may have off")
+    parser.add_argument("--max-distance", type = int, default = 4, help = "hash bits a frame may have off")
+    args = parser.parse_args(args)
+
+    if args.mode == "record":
+        if len(args.files) != 1:
+            parser.error("record takes one file")
+        w, h = args.size.lower().split("x")
+        frames, elapsed = record(args.files[0], (int(w), int(h)), args.backend, args.aa, args.count, args.seed)
+        print("recorded %d frames in %.2fs (%.0f poses/s)" % (frames, elapsed, frames / elapsed))
+        return 0
+
+    failed = 0
+    for file in args.files or GOLDEN_FILES:
+        failures, frames, elapsed = check(file, args.tolerance, args.max_pixels, args.max_distance)
+        for label, distance, pixels, largest in failures:
+            if pixels < 0:
+                print("%-16s hash %2d bits off" % (label, distance))
+            else:
+                print("%-16s hash %2d bits off, %d pixels off by up to %d" % (label, distance, pixels, largest))
+        print("%s: %d of %d frames failed in %.2fs (%.0f poses/s)" % (os.path.basename(file), len(failures), frames,
+                                                                     elapsed, frames / elapsed))
+        failed += len(failures)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
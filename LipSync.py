@@ -0,0 +1,162 @@
+import numpy as np
+import wave
+
+from Narrator import FACIAL_FIELDS, FIELD_INDEX
+
+def decodePCM(data, channels, width):
+    # little endian PCM bytes to mono float samples in [-1, 1]
+    if width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128.
+    elif width == 2:
+        samples = np.frombuffer(data, dtype="<i2").astype(np.float32) / 32768.
+    elif width == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape((-1, 3)).astype(np.int32)
+        samples = ((raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)) << 8 >> 8).astype(np.float32) / 8388608.
+    elif width == 4:
+        samples = np.frombuffer(data, dtype="<i4").astype(np.float32) / 2147483648.
+    else:
+        raise ValueError("unsupported sample width %d" % width)
+
+    if channels > 1:
+        samples = samples.reshape((-1, channels)).mean(axis=1)
+
+    return samples
+
+def readWave(file, chunk = 65536):
+    with wave.open(file, "rb") as w:
+        if w.getcomptype() != "NONE":
+            raise ValueError("only uncompressed wav files are supported")
+
+        channels = w.getnchannels()
+        width = w.getsampwidth()
+        while True:
+            data = w.readframes(chunk)
+            if not data:
+                break
+            yield decodePCM(data, channels, width)
+
+def readPCM(stream, channels = 1, width = 2, chunk = 65536):
+    # raw PCM, e.g. sys.stdin.buffer, reads can end in the middle of a sample
+    frame = channels * width
+    rest = b""
+    while True:
+        data = stream.read(chunk * frame)
+        if not data:
+            break
+        data = rest + data
+        end = len(data) - (len(data) % frame)
+        rest = data[end:]
+        if end:
+            yield decodePCM(data[:end], channels, width)
+
+def getWaveRate(file):
+    with wave.open(file, "rb") as w:
+        return w.getframerate()
+
+class LipSync:
+    def __init__(self, neutral, rate, fps = 30):
+        self.neutral = np.array(neutral, dtype=np.float64).reshape(len(FACIAL_FIELDS))
+        self.rate = rate
+        self.fps = fps
+        self.window = int(rate // fps)
+        self.hann = np.hanning(self.window).astype(np.float32)
+        self.freqs = np.fft.rfftfreq(self.window, 1. / rate)
+
+        # loudness is mapped from this dBFS range onto 0 - 1
+        self.floor_db = -50.
+        self.ceil_db = -10.
+        self.bright_hz = 4000.
+
+        # how much of the target the smoothed loudness and brightness move each frame when rising and falling
+        self.attack = .6
+        self.release = .3
+
+        self.open_range = .35
+        self.width_range = .2
+        self.smile_range = 1.
+        self.brow_range = .1
+
+        self.buffer = np.empty(0, dtype=np.float32)
+        self.offset = 0
+        self.frame = 0
+        self.loudness = 0.
+        self.brightness = .5
+
+    def getStart(self, frame):
+        return (frame * self.rate) // self.fps
+
+    def getFeatures(self, windows):
+        rms = np.sqrt(np.mean(windows * windows, axis=1))
+        db = 20 * np.log10(rms + 1e-9)
+        loudness = np.clip((db - self.floor_db) / (self.ceil_db - self.floor_db), 0, 1)
+
+        spectrum = np.abs(np.fft.rfft(windows * self.hann, axis=1))
+        total = spectrum.sum(axis=1)
+        centroid = (spectrum @ self.freqs) / np.where(total > 0, total, 1)
+        brightness = np.where(total > 0, np.clip(centroid / self.bright_hz, 0, 1), .5)
+
+        return loudness, brightness
+
+    def smooth(self, loudness, brightness):
+        for i in range(len(loudness)):
+            rate = self.attack if loudness[i] > self.loudness else self.release
+            self.loudness += (loudness[i] - self.loudness) * rate
+            self.brightness += (brightness[i] - self.brightness) * rate
+            loudness[i] = self.loudness
+            brightness[i] = self.brightness
+
+    def getValues(self, loudness, brightness):
+        values = np.repeat(self.neutral[None], len(loudness), axis=0)
+        shape = brightness - .5
+
+        values[:, FIELD_INDEX["mh"]] += loudness * self.open_range
+        values[:, FIELD_INDEX["mw"]] += shape * loudness * self.width_range
+        values[:, FIELD_INDEX["sa"]] += shape * loudness * self.smile_range
+        values[:, FIELD_INDEX["rbe"]] += loudness * self.brow_range
+        values[:, FIELD_INDEX["lbe"]] += loudness * self.brow_range
+
+        return values
+
+    def feed(self, samples):
+        # returns the times and (frames, 14) values of every frame completed by these samples
+        self.buffer = np.concatenate((self.buffer, samples))
+        end = self.offset + len(self.buffer)
+
+        # the last frame whose window ends inside the buffer
+        last = (((end - self.window + 1) * self.fps) - 1) // self.rate
+        count = max(0, last - self.frame + 1)
+
+        frames = np.arange(self.frame, self.frame + count)
+        starts = self.getStart(frames) - self.offset
+        windows = self.buffer[starts[:, None] + np.arange(self.window)]
+
+        self.frame += count
+        start = self.getStart(self.frame)
+        self.buffer = self.buffer[start - self.offset:]
+        self.offset = start
+
+        loudness, brightness = self.getFeatures(windows)
+        self.smooth(loudness, brightness)
+
+        return frames / float(self.fps), self.getValues(loudness, brightness)
+
+    def stream(self, chunks):
+        for samples in chunks:
+            times, values = self.feed(samples)
+            if len(values):
+                yield times, values
+
+def renderLipSync(narrator, chunks, rate, writer, fps = 30):
+    sync = LipSync(narrator.getFacialValues(), rate, fps)
+    frames = 0
+    for times, values in sync.stream(chunks):
+        for row in values:
+            narrator.setFacialValues(row.tolist())
+            narrator.update()
+            if narrator.draw() == [] and frames > 0:
+                writer.repeat()
+            else:
+                writer.write(narrator.viewer.display)
+            frames += 1
+
+    return frames
@@ -1,10 +1,51 @@
-from pygame import gfxdraw
-import pyclipper
+from collections import OrderedDict
+import argparse
+import importlib.util
 import numpy as np
-import pygame
 import math
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
 import timeit
-import tkinter as tk
+
+from Profiler import profiler
+from Raster import Canvas
+from Rig import QUEEN, Rig
+
+class MissingModule:
+    # stands in for a module that is not installed, so only what uses it fails
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        raise ImportError("%s is not installed" % self.name, name = self.name)
+
+def lazyImport(name):
+    # the module is only loaded on its first attribute access, so importing this file
+    # stays cheap for jobs that never draw, a module that is not installed raises an
+    # ImportError when it is first used, so numpy only jobs run without pygame
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        return MissingModule(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+# pygame loads on the first draw, when a video may already be streaming to stdout, so its banner is
+# kept out of the stream, the render workers inherit this
+os.environ.setdefault("PYGAME_HIDE_SUPPORT_PROMPT", "1")
+
+pygame = lazyImport("pygame")
+pyclipper = lazyImport("pyclipper")
 
 class Rect:
     def __init__(self, size = (1., 1.), pos = (0., 0.), color = (0, 0, 0)):
@@ -18,18 +59,10 @@ class Rect:
     def getCenter(self):
         return self.pos - (self.size / 2)
 
-    def getPoints(self):
-        points = None
-        masks = np.array([[-1, 1], [1, 1], [1, -1], [-1, -1]])
-
-        for mask in masks:
-            point = self.pos + ((mask / 2.) * self.size)
-            if points is None:
-                points = np.array([point])
-            else:
-                points = np.append([point], points, axis=0)
+    masks = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) / 2.
 
-        return points
+    def getPoints(self):
+        return self.pos + (Rect.masks * self.size)
 
     def getPoly(self):
         pos = np.array(self.pos)
@@ -47,7 +80,7 @@ class Rect:
         self.pos *= s
         self.size *= s
 
-    def draw(self, display):
+    def draw(self, display, view = None):
         center = self.pos - (self.size / 2)
         #pygame.gfxdraw.rect(display, self.color, pygame.Rect(center, self.size))
 
@@ -58,6 +91,30 @@ def rot(p, a):
 
     return point
 
+def rotation(a):
+    c = math.cos(a)
+    s = math.sin(a)
+    return np.array([[c, -s, 0.],
+                     [s,  c, 0.],
+                     [0., 0., 1.]])
+
+def scaling(s):
+    s = np.broadcast_to(np.asarray(s, dtype=np.float64), (2,))
+    return np.array([[s[0], 0., 0.],
+                     [0., s[1], 0.],
+                     [0., 0., 1.]])
+
+def translation(t):
+    return np.array([[1., 0., t[0]],
+                     [0., 1., t[1]],
+                     [0., 0., 1.]])
+
+def transform(points, matrix, out = None):
+    # applies a 3x3 affine matrix to a whole (n, 2) point array at once
+    out = np.matmul(points, matrix[:2, :2].T, out=out)
+    out += matrix[:2, 2]
+    return out
+
 def getAngle(point, center = np.array([0, 0])):
     point -= center
     ra = math.pi / 2
@@ -84,12 +141,207 @@ def setMag(point, mag):
 def midPoint(p1, p2):
     return (p1 + p2) / 2.0
 
+mouth_steps = {}
+
+def getMouthSteps(res):
+    steps = mouth_steps.get(res)
+    if steps is None:
+        steps = mouth_steps[res] = np.linspace(-1, 1, (2 * res) + 1)
+    return steps
+
+def mouthCurve(width, height, smile, openess = (1, 1), res = 10, out = None):
+    # the mouth polygon for scalar parameters or for arrays of them, one curve per value,
+    # written into out when it is given
+    width = np.asarray(width, dtype=np.float64)[..., None]
+    height = np.asarray(height, dtype=np.float64)[..., None]
+    smile = np.asarray(smile, dtype=np.float64)[..., None]
+
+    steps = getMouthSteps(res)
+    n = len(steps)
+    if out is None:
+        out = np.empty(np.broadcast(width, height, smile).shape[:-1] + (2 * n, 2))
+
+    half = height * (openess[1] / 2.0)
+    x1 = out[..., :n, 0]
+    np.multiply(steps, width * openess[0], out=x1)
+    out[..., n:, 0] = x1[..., ::-1]
+    y1 = out[..., :n, 1]
+    np.multiply(x1, x1, out=y1)
+    y1 *= smile
+    y1 -= half
+    out[..., n:, 1] = y1 + half
+
+    return out
+
+class MouthCache:
+    # tessellated mouth curves keyed by their parameters rounded to step, so a viseme that comes
+    # back is not tessellated again, the curves are written into a preallocated slab per resolution
+    # and a miss reuses the least recently used slot, so a cache must only feed one mouth
+    def __init__(self, size = 256, step = 1e-4):
+        self.size = size
+        self.step = step
+        self.slabs = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, width, height, smile, openess = (1, 1), res = 10):
+        step = self.step
+        key = (round(width / step), round(height / step), round(smile / step),
+               round(openess[0] / step), round(openess[1] / step))
+
+        slab = self.slabs.get(res)
+        if slab is None:
+            slab = self.slabs[res] = (np.empty((self.size, 2 * len(getMouthSteps(res)), 2)), OrderedDict())
+        buffer, curves = slab
+
+        entry = curves.get(key)
+        if entry is not None:
+            curves.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        if len(curves) < self.size:
+            slot = len(curves)
+        else:
+            slot = curves.popitem(last=False)[1][0]
+
+        # the curve is built from the rounded parameters so it does not depend on which
+        # parameters filled the slot first
+        curve = buffer[slot]
+        mouthCurve(key[0] * step, key[1] * step, key[2] * step, (key[3] * step, key[4] * step), res, curve)
+        curve.flags.writeable = False
+        curves[key] = (slot, curve)
+
+        return curve
+
+    def clear(self):
+        self.slabs.clear()
+
+
+# outlines are offset in local space, scaled up so pyclipper's integer coordinates keep sub pixel precision
+OUTLINE_SCALE = 2 ** 20
+
+def offsetOutline(points, width, tolerance = .25):
+    pco = pyclipper.PyclipperOffset()
+    pco.ArcTolerance = tolerance * OUTLINE_SCALE
+    pco.AddPath(np.rint(points * OUTLINE_SCALE).astype(np.int64).tolist(), pyclipper.JT_ROUND, pyclipper.ET_CLOSEDPOLYGON)
+
+    outline = pco.Execute(width * OUTLINE_SCALE)
+    if not outline:
+        return np.empty((0, 2))
+
+    return np.array(outline[0], dtype=np.float64) / OUTLINE_SCALE
+
+def similarityScale(matrix):
+    # the scale of a rotation/reflection + uniform scale matrix, None for anything that shears or stretches
+    a = matrix[:2, 0]
+    b = matrix[:2, 1]
+    la = math.hypot(a[0], a[1])
+    lb = math.hypot(b[0], b[1])
+    if la == 0 or abs(la - lb) > 1e-9 * la or abs(np.dot(a, b)) > 1e-9 * la * lb:
+        return None
+
+    return la
+
+class OutlineCache:
+    def __init__(self, size = 512):
+        self.size = size
+        self.outlines = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, points, width, tolerance):
+        key = (points.shape, points.tobytes(), round(width, 12), round(tolerance, 12))
+        outline = self.outlines.get(key)
+        if outline is not None:
+            self.outlines.move_to_end(key)
+            self.hits += 1
+            return outline
+
+        self.misses += 1
+        outline = offsetOutline(points, width, tolerance)
+        self.outlines[key] = outline
+        if len(self.outlines) > self.size:
+            self.outlines.popitem(last=False)
+
+        return outline
+
+    def clear(self):
+        self.outlines.clear()
+
+outline_cache = OutlineCache()
+
+def drawPolygon(display, color, points):
+    # a Raster.Canvas fills the polygon itself, anything else is a pygame surface
+    polygon = getattr(display, "polygon", None)
+    if polygon is not None:
+        polygon(color, points)
+    else:
+        pygame.draw.polygon(display, color, points.tolist() if isinstance(points, np.ndarray) else points)
+
+def overlaps(a, b):
+    # whether two (x, y, w, h) rects share a pixel
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+def mergeRects(rects, size):
+    # the rects clipped to a display of size with the overlapping ones joined into their bounding
+    # rect, so no pixel is cleared and drawn twice
+    w, h = size
+    merged = []
+    for x, y, rw, rh in rects:
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + rw, w), min(y + rh, h)
+        if x1 <= x0 or y1 <= y0:
+            continue
+
+        rect = (x0, y0, x1 - x0, y1 - y0)
+        joined = True
+        while joined:
+            joined = False
+            for other in merged:
+                if overlaps(rect, other):
+                    merged.remove(other)
+                    x0, y0 = min(rect[0], other[0]), min(rect[1], other[1])
+                    x1 = max(rect[0] + rect[2], other[0] + other[2])
+                    y1 = max(rect[1] + rect[3], other[1] + other[3])
+                    rect = (x0, y0, x1 - x0, y1 - y0)
+                    joined = True
+                    break
+        merged.append(rect)
+
+    return merged
+
+class RotationCache:
+    # the 2x2 rotation of every recently used angle, polys at the same angle share one matrix
+    def __init__(self, size = 1024):
+        self.size = size
+        self.rotations = OrderedDict()
+
+    def get(self, a):
+        a = float(a)
+        r = self.rotations.get(a)
+        if r is not None:
+            self.rotations.move_to_end(a)
+            return r
+
+        r = rotation(a)[:2, :2]
+        r.flags.writeable = False
+        self.rotations[a] = r
+        if len(self.rotations) > self.size:
+            self.rotations.popitem(last=False)
+
+        return r
+
+    def clear(self):
+        self.rotations.clear()
+
+rotation_cache = RotationCache()
 
 class Poly:
     def __init__(self, points = Rect().getPoints(), pos = (0, 0), color = (0, 0, 0)):
-        self.points = np.array(points)
+        self.points = points
         self.pos = np.array(pos)
-        self.points = self.points.astype(np.float64)
         self.pos = self.pos.astype(np.float64)
 
         self.color = color
@@ -97,11 +349,47 @@ class Poly:
         self.outline = .08
 
         self.dir = 0
+        self.size = np.ones(2)
+
+        self.screen = None
+        self.stage_name = "draw poly"
+        self.outline_key = None
+        self.outline_points = None
+        self.bounds_base = None
+        self.local_corners = None
+        self.box = None
+
+    # self.base holds the points in local space as they were set and the pose (self.pos,
+    # self.dir and self.size) places them, so setting an angle never accumulates rounding,
+    # self.points is the posed shape without the translation and only recomputed when the pose changed
+    @property
+    def points(self):
+        key = (self.dir, self.size[0], self.size[1])
+        if self.transformed_key != key:
+            self.transformed = np.matmul(self.base, self.getLinear().T)
+            self.transformed_key = key
+        return self.transformed
+
+    @points.setter
+    def points(self, points):
+        # read only arrays are shared as they are, writable ones are copied
+        if isinstance(points, np.ndarray) and points.dtype == np.float64 and not points.flags.writeable:
+            self.base = points
+        else:
+            self.base = np.array(points, dtype=np.float64)
+        self.transformed_key = None
 
-    def rotate(self, a):
-        for i, point in enumerate(self.points):
-            self.points[i] = rot(point, a)
+    def getLinear(self):
+        return rotation_cache.get(self.dir) * self.size
 
+    def getMatrix(self):
+        matrix = np.empty((3, 3))
+        matrix[:2, :2] = self.getLinear()
+        matrix[:2, 2] = self.pos
+        matrix[2] = (0., 0., 1.)
+        return matrix
+
+    def rotate(self, a):
         self.dir += a
 
         return self
@@ -110,8 +398,7 @@ class Poly:
         return self.dir#getAngle(midPoint(self.points[0], self.points[6 % (len(self.points) - 1)]))
 
     def setDir(self, d):
-        sd = self.getDir()
-        self.rotate(-sd + d)
+        self.dir = d
 
         return self
 
@@ -120,10 +407,7 @@ class Poly:
 
 
     def scale(self, s):
-        for point in self.points:
-            point += self.pos
-            point *= s
-            point -= self.pos
+        self.size = self.size * s
 
         return self
 
@@ -132,516 +416,972 @@ class Poly:
 
         return self
 
-    def draw(self, display):
-        points = []
-        for point in self.points:
-            points.append([point[0] + self.pos[0], point[1] + self.pos[1]])
+    def getScreenMatrix(self, view = None):
+        return self.getMatrix() if view is None else view @ self.getMatrix()
+
+    def project(self, view = None, matrix = None):
+        if matrix is None:
+            matrix = self.getScreenMatrix(view)
+        if self.screen is None or self.screen.shape != self.base.shape:
+            self.screen = np.empty_like(self.base)
+        return transform(self.base, matrix, self.screen)
+
+    def getOutline(self, matrix, width, tolerance = .25):
+        k = similarityScale(matrix)
+        if k is None:
+            # a view that stretches, e.g. on a display that is not square, has no scale to take out,
+            # the outline is offset after the linear part of matrix and cached for it, so a poly that
+            # only moves reuses it
+            linear = matrix[:2, :2]
+            key = (self.base, linear.tobytes(), width, tolerance)
+            if self.outline_key is None or self.outline_key[0] is not self.base or self.outline_key[1:] != key[1:]:
+                self.outline_points = outline_cache.get(self.base @ linear.T, width, tolerance)
+                self.outline_key = key
+
+            return self.outline_points + matrix[:2, 2]
+
+        # a rigid move or uniform zoom only re-transforms the outline offset in local space
+        key = (self.base, width / k, tolerance / k)
+        if self.outline_key is None or self.outline_key[0] is not self.base or self.outline_key[1:] != key[1:]:
+            self.outline_points = outline_cache.get(*key)
+            self.outline_key = key
+
+        return transform(self.outline_points, matrix)
+
+    def getBounds(self, matrix = None):
+        # the axis aligned box around the posed points as its min and max corners, from
+        # the corners of the local shape's box which is only found again for new points
+        if self.bounds_base is not self.base:
+            low = self.base.min(axis=0).tolist()
+            high = self.base.max(axis=0).tolist()
+            self.local_corners = ((low[0], low[1]), (high[0], low[1]), (high[0], high[1]), (low[0], high[1]))
+            self.bounds_base = self.base
+
+        # four points are quicker in plain python than in numpy
+        (a, b, c), (d, e, f), _ = (self.getMatrix() if matrix is None else matrix).tolist()
+        xs = [(a * x) + (b * y) + c for x, y in self.local_corners]
+        ys = [(d * x) + (e * y) + f for x, y in self.local_corners]
+        return (min(xs), min(ys)), (max(xs), max(ys))
+
+    def getOutlineWidth(self, size):
+        # outlines are self.outline tenths of the smaller side of the display wide, in pixels
+        return self.outline * (min(size) / 10)
+
+    def isVisible(self, matrix, size):
+        # whether the box around the poly on screen, with matrix as its screen matrix, touches the display
+        low, high = self.getBounds(matrix)
+        margin = self.getOutlineWidth(size) if self.outline else 0.
+        return (high[0] + margin >= 0 and high[1] + margin >= 0 and
+                low[0] - margin <= size[0] and low[1] - margin <= size[1])
+
+    def getBox(self, matrix, size):
+        # the pixels the poly and its outline can touch on a display of size as an (x, y, w, h) rect,
+        # with a pixel more on every side for rounding
+        low, high = self.getBounds(matrix)
+        margin = (self.getOutlineWidth(size) if self.outline else 0.) + 1.
+        x = math.floor(low[0] - margin)
+        y = math.floor(low[1] - margin)
+        return (x, y, math.ceil(high[0] + margin) - x, math.ceil(high[1] + margin) - y)
+
+    def draw(self, display, view = None, tolerance = .25, min_outline = 0., cull = False):
+        # outlines are offset with an arc tolerance of tolerance pixels and left out when they would
+        # be thinner than min_outline pixels, returns False when the poly was culled
+        with profiler.stage(self.stage_name):
+            matrix = self.getScreenMatrix(view)
+            size = display.get_size()
+            if cull and not self.isVisible(matrix, size):
+                self.box = None
+                return False
+
+            # what the poly covers is kept for the next partial redraw
+            self.box = self.getBox(matrix, size)
+
+            points = self.project(matrix=matrix)
+
+            width = self.getOutlineWidth(size)
+            if self.outline and width >= min_outline:
+                with profiler.stage("outline"):
+                    outline = self.getOutline(matrix, width, tolerance)
+
+                if len(outline):
+                    with profiler.stage("polygon"):
+                        drawPolygon(display, (0, 0, 0), outline)
+
+            with profiler.stage("polygon"):
+                drawPolygon(display, self.color, points)
+
+        return True
+
+class Camera:
+    def __init__(self, viewing_area = None):
+        if viewing_area is None:
+            viewing_area = Rect((10, 10), (-5, -6))
+        self.viewing_area = viewing_area
+
+    def pan(self, d):
+        self.viewing_area.pos += d
 
-        if self.outline:
-            pco = pyclipper.PyclipperOffset()
-            pco.AddPath(points, pyclipper.JT_ROUND, pyclipper.ET_CLOSEDPOLYGON)
+        return self
 
-            outline = pco.Execute(self.outline * (min(pygame.display.get_surface().get_size()) / 10))[0]
+    def zoom(self, f):
+        center = self.viewing_area.pos + (self.viewing_area.size / 2)
+        self.viewing_area.size /= f
+        self.viewing_area.pos = center - (self.viewing_area.size / 2)
 
-            pygame.draw.polygon(display, (0, 0, 0), outline)
+        return self
 
-        pygame.draw.polygon(display, self.color, points)
+    def getMatrix(self, size):
+        scale = np.array(size, dtype=np.float64) / self.viewing_area.size
+        return scaling(scale) @ translation(-self.viewing_area.pos)
 
 class Viewer:
-    def __init__(self):
-        self.display = pygame.display.set_mode((800, 800))
-        self.viewing_area = Rect((10, 10), (-5, -6))
+    # the "numpy" backend draws into a Raster.Canvas, whose buffer is shown in the window
+    # when there is one, headless numpy viewers never load pygame
+    def __init__(self, size = (800, 800), headless = False, camera = None, backend = "pygame", aa = 1):
+        self.headless = headless
+        self.backend = backend
+        self.window = None
+        if backend == "numpy":
+            self.display = Canvas(size, aa)
+            if not headless:
+                self.window = pygame.display.set_mode(size)
+        elif backend != "pygame":
+            raise ValueError("unknown backend %r" % backend)
+        elif headless:
+            self.display = pygame.Surface(size)
+        else:
+            self.display = pygame.display.set_mode(size)
+        self.camera = camera if camera is not None else Camera()
+
+        # level of detail, outline arcs are kept within arc_tolerance pixels, outlines thinner than
+        # min_outline pixels are left out and polys whose boxes miss the display are culled
+        self.arc_tolerance = .25
+        self.min_outline = .5
+        self.cull = True
+        self.culled = 0
+
+        # redraw skips frames where nothing changed and only clears and draws the boxes of the polys
+        # that changed while partial is on, view is the screen matrix of the frame on the display, None
+        # when something else drew on it, and dirty_rects what the last redraw changed, None for all of it
+        self.background = (100, 180, 110)
+        self.partial = True
+        self.view = None
+        self.dirty_rects = None
+
+    @property
+    def viewing_area(self):
+        return self.camera.viewing_area
+
+    def getScale(self, camera = None):
+        # pixels per world unit, the geometric mean of both axes when they differ
+        camera = self.camera if camera is None else camera
+        view = camera.getMatrix(self.display.get_size())
+        k = similarityScale(view)
+        return k if k is not None else math.sqrt(abs(np.linalg.det(view[:2, :2])))
 
     def clear(self):
-        self.display.fill((100, 180, 110))
-
-    def draw(self, things):
-        shift = np.array(self.viewing_area.pos)
-        scale = np.array(self.display.get_size()) / np.array(self.viewing_area.size)
+        self.view = None
+        self.dirty_rects = None
+        self.display.fill(self.background)
 
-        #print(shift, scale, np.array(self.display.get_size()))
+    def draw(self, things, camera = None):
+        camera = self.camera if camera is None else camera
+        view = camera.getMatrix(self.display.get_size())
+        self.view = None
+        self.dirty_rects = None
 
         for thing in things:
-            thing.shift(shift)
-            thing.scale(scale)
-            thing.draw(self.display)
+            if not isinstance(thing, Poly):
+                thing.draw(self.display, view)
+            elif not thing.draw(self.display, view, self.arc_tolerance, self.min_outline, self.cull):
+                self.culled += 1
+
+    def redraw(self, polys, dirty, camera = None):
+        # draws polys over the frame the last redraw left on the display, where only the polys at the
+        # indexes in dirty changed since, the boxes they covered then and cover now are cleared and
+        # everything in them is drawn again, returns the rects that changed, [] when nothing did
+        # and None when the whole display was drawn
+        camera = self.camera if camera is None else camera
+        size = self.display.get_size()
+        view = camera.getMatrix(size)
+
+        if self.view is None or not np.array_equal(view, self.view) or (dirty and not self.partial):
+            self.clear()
+            self.draw(polys, camera)
+            self.view = view
+            return None
+
+        if not dirty:
+            self.dirty_rects = []
+            return []
+
+        rects = []
+        for i in dirty:
+            poly = polys[i]
+            if poly.box is not None:
+                rects.append(poly.box)
+            poly.box = poly.getBox(poly.getScreenMatrix(view), size)
+            rects.append(poly.box)
+
+        rects = mergeRects(rects, size)
+        for rect in rects:
+            self.display.set_clip(rect)
+            self.display.fill(self.background)
+            for poly in polys:
+                if poly.box is not None and overlaps(poly.box, rect):
+                    if not poly.draw(self.display, view, self.arc_tolerance, self.min_outline, self.cull):
+                        self.culled += 1
+        self.display.set_clip(None)
+
+        self.dirty_rects = rects
+        return rects
+
+    def render(self):
+        # only the rects the last redraw changed are sent to the window
+        if not self.headless and self.dirty_rects != []:
+            with profiler.stage("display update"):
+                rects = self.dirty_rects
+                if self.window is not None:
+                    frame = pygame.image.frombuffer(self.display.buffer, self.display.get_size(), "RGB")
+                    for rect in rects or ((0, 0) + self.display.get_size(),):
+                        self.window.blit(frame, rect[:2], rect)
+                if rects is None:
+                    pygame.display.update()
+                else:
+                    pygame.display.update(rects)
+
+class FrameScheduler:
+    # paces a loop to fps by sleeping and hands out fixed simulation steps of step seconds,
+    # independent of how long rendering takes
+    def __init__(self, fps = 60, step = None, max_steps = 5):
+        self.fps = fps
+        self.frame_time = 1. / fps
+        self.step = self.frame_time if step is None else step
+        self.max_steps = max_steps
 
-        shift *= -1
-        scale = 1 / scale
+        self.start()
 
-        for thing in things:
-            thing.scale(scale)
-            thing.shift(shift)
+    def start(self):
+        self.last = timeit.default_timer()
+        self.next = self.last + self.frame_time
+        self.accumulator = 0.
+
+        self.frames = 0
+        self.late = 0
+        self.skipped = 0
+        self.dropped_steps = 0
+
+    def tick(self):
+        # the number of simulation steps to run before the next frame is rendered
+        now = timeit.default_timer()
+        self.accumulator += now - self.last
+        self.last = now
+
+        steps = int(self.accumulator // self.step)
+        if steps > self.max_steps:
+            # too far behind to catch up, let the simulation slow down instead of spiraling
+            self.dropped_steps += steps - self.max_steps
+            steps = self.max_steps
+            self.accumulator = 0.
+        else:
+            self.accumulator -= steps * self.step
 
-    def render(self):
-        pygame.display.update()
+        return steps
+
+    def wait(self):
+        self.frames += 1
+        delay = self.next - timeit.default_timer()
+        if delay > 0:
+            time.sleep(delay)
+            self.next += self.frame_time
+        else:
+            # missed the frame, skip the ones that are already over instead of rendering a burst
+            self.late += 1
+            behind = int(-delay // self.frame_time)
+            self.skipped += behind
+            self.next += (behind + 1) * self.frame_time
+
+    def getStats(self):
+        return {"fps": self.fps,
+                "frames": self.frames,
+                "late": self.late,
+                "skipped": self.skipped,
+                "dropped_steps": self.dropped_steps}
+
+FACIAL_FIELDS = ("hr", "he", "hs", "mw", "mh", "me", "sa", "es", "reo", "leo", "rbe", "lbe", "rbr", "lbr")
+
+FIELD_INDEX = {name: i for i, name in enumerate(FACIAL_FIELDS)}
+
+# the body position, mouth openess and mouth resolution are tracked along side the facial parameters,
+# Narrator.update only redoes the parts whose shape or pose depends on a field that changed
+STATE_FIELDS = FACIAL_FIELDS + ("body", "body", "mo", "mo", "mr")
+
+def poseRig(narrator, values):
+    # poses the narrator's parts for a (frames, 14) array of facial parameters at once, every part
+    # gets its local shape ((n, 2) when all frames share it, (frames, n, 2) otherwise), its rotation
+    # and its position for every frame, the narrator is not changed
+    return narrator.rig.pose(values, narrator.pos, narrator.getMouthCurves)
+
+def evaluateRig(narrator, values):
+    # the world space vertices of every part as (frames, n, 2) arrays
+    return narrator.rig.evaluate(values, narrator.pos, narrator.getMouthCurves)
 
 class Narrator:
-    def __init__(self, pos = (0, -30)):
+    def __init__(self, pos = (0, 0), headless = False, size = (800, 800), fps = 60, backend = "pygame", aa = 1, rig = None):
 
-        self.snapshots = []
-        self.snapshot_frame = 0
+        self.snapshots = Timeline()
+        self.snapshot_time = 0
+        self.interpolation = "linear"
 
         self.dt = 0
         self.t = timeit.default_timer()
+        self.scheduler = FrameScheduler(fps)
 
-        self.viewer = Viewer()
+        self.viewer = Viewer(size, headless, backend = backend, aa = aa)
 
         self.pos = np.array(pos)
         self.pos = self.pos.astype(np.float64)
 
-        self.body = Rect((1, 3), self.pos, color = (51, 51, 51))
+        # the parts come from a character file, see Rig.py
+        if rig is None:
+            rig = QUEEN
+        self.rig = rig if isinstance(rig, Rig) else Rig.load(rig, FACIAL_FIELDS)
 
-        points = np.array([ [1/3., 0],
-                            [.1,.26],
-                            [.2,.285],
-                            [.095,.31],
-                            [.0625,.77],
-                            [.138,.795],
-                            [.05,.82],
-                            [.15,1]])
+        self.polys = []
+        for i, name in enumerate(self.rig.names):
+            poly = Poly(Rect().getPoints() if self.rig.shapes[i] is None else self.rig.shapes[i], color = self.rig.colors[i])
+            poly.outline = self.rig.outlines[i]
+            poly.stage_name = "draw " + name
+            self.polys.append(poly)
+        self.parts = dict(zip(self.rig.names, self.polys))
 
-        points[:,1] -= .5
-        points *= 2.8
-        flip = np.array([points[:, i] for i in range(len(points[0]))])[:,::-1]
-        flip[0] *= -1
-        flip = np.array([flip[:, i] for i in range(len(flip[0]))])
-        points = np.append(flip, points, axis=0)
-        points[:,1] *= -1
-
-        self.queen_body = Poly(points, self.pos, color = (51, 51, 51))
-
-        self.head = Poly(Rect((1, 1)).getPoints(), (0, 0), color = (51, 51, 51))
+        self.shape_dependencies = [fields | ({"mo", "mr"} if i in self.rig.mouths else set())
+                                   for i, fields in enumerate(self.rig.shape_fields)]
+        self.pose_dependencies = [fields | {"body"} for fields in self.rig.pose_fields]
 
         self.head_escalation = .8
         self.head_shift = 0
         self.head_rotation = 0
 
-
-        self.crown_size = 1.2
-        crown_points = [[0, 0],
-                        [0, 3 / 4.],
-                        [1 / 4., 2 / 4.],
-                        [1 / 2., 3 / 4.],
-                        [3 / 4., 2 / 4.],
-                        [1, 3 / 4.],
-                        [1, 0]]
-
-        crown_points = np.array(crown_points)
-
-        for i in range(len(crown_points)):
-            p = crown_points[i]
-            crown_points[i] = ((p * self.crown_size) - (self.crown_size / 2.)) * np.array([1, -1])
-
-        self.crown = Poly(crown_points, color = (255, 215, 0))
-
         self.eye_size = .15
         self.eye_openess = [1, 1]
-        size = (self.eye_size, self.eye_size)
-        color = (255, 255, 255)
-
-        self.eyes = [Rect(size, color = color).getPoly(), Rect(size, color = color).getPoly()]
-        self.eyes[0].outline = .06
-        self.eyes[1].outline = .06
 
         self.mouth_width = .3
         self.mouth_height = .1
         self.mouth_openess = [1, 1]
         self.smile_amt = 0
 
-        self.mouth_escalation = .6
-
-        size = (self.mouth_width, self.mouth_height)
+        # points per side of the mouth curve is 2 * mouth_res + 1 at most, fewer when the mouth
+        # is small on screen, mouth_spacing = 0 always uses mouth_res, every mouth part has its own cache
+        self.mouth_res = 10
+        self.mouth_spacing = 2.
+        self.mouth_lod = None
+        self.mouth_caches = {i: MouthCache() for i in self.rig.mouths}
 
-        self.mouth = Rect(size, color = color).getPoly()
-        self.mouth.outline = .06
-        self.setMouth()
+        self.mouth_escalation = .6
 
         self.eb_rotatioins = [.1, -.1]
-        self.eb_width = .32
-        self.eb_height = .03
         self.eb_escalations = [.3, .3]
 
-        size = (self.eb_width, self.eb_height)
+        # the indexes of the parts that changed since they were last drawn
+        self.dirty_parts = set(range(len(self.polys)))
+
+        self.setMouth()
 
-        self.eye_brows = [Rect(size, color = color).getPoly(), Rect(size, color = color).getPoly()]
-        self.eye_brows[0].outline = .06
-        self.eye_brows[1].outline = .06
+        self.state = None
 
-        self.control = Control(self)
-        self.control_on = 1
+        # the tk editor is created by edit()
+        self.control = None
 
     def loadSnapshot(self, file):
-        pass
+        self.snapshots = Timeline.load(file)
+        self.snapshot_time = 0
+
+    def saveSnapshot(self, file):
+        self.snapshots.save(file)
+
+    def getFacialValues(self):
+        return [self.head_rotation,
+                self.head_escalation,
+                self.head_shift,
+                self.mouth_width,
+                self.mouth_height,
+                self.mouth_escalation,
+                self.smile_amt,
+                self.eye_size,
+                self.eye_openess[0],
+                self.eye_openess[1],
+                self.eb_escalations[0],
+                self.eb_escalations[1],
+                self.eb_rotatioins[0],
+                self.eb_rotatioins[1]]
+
+    def setFacialValues(self, values):
+        (self.head_rotation,
+         self.head_escalation,
+         self.head_shift,
+         self.mouth_width,
+         self.mouth_height,
+         self.mouth_escalation,
+         self.smile_amt,
+         self.eye_size,
+         self.eye_openess[0],
+         self.eye_openess[1],
+         self.eb_escalations[0],
+         self.eb_escalations[1],
+         self.eb_rotatioins[0],
+         self.eb_rotatioins[1]) = values
+
+    def setFacialValue(self, name, value):
+        # changes one field, update only redoes the parts that depend on it
+        values = self.getFacialValues()
+        values[FIELD_INDEX[name]] = value
+        self.setFacialValues(values)
+
+    def getState(self):
+        return tuple(self.getFacialValues()) + (self.pos[0], self.pos[1],
+                                                self.mouth_openess[0], self.mouth_openess[1], self.mouth_res)
+
+    def markDirty(self):
+        self.state = None
 
     def takeFacialSnapshot(self):
         snap = FacialSnapshot()
         snap.takeSnapshot(self)
         return snap
 
-    def applyFacialSnapshot(self, snapshot):
-        target_snap = snapshot
-        current_snap = FacialSnapshot()
-        current_snap.takeSnapshot(self)
-
-        diff = target_snap.getValues() - current_snap.getValues()
-        new_vals = current_snap.getValues() + (diff * self.dt * 1)
-
-        if abs(np.sum(diff)) > .001:
-            current_snap.setValues(new_vals)
-            current_snap.applyFacialSnapshot(self)
-
-            return 1
-
-        else:
-            return 0
-
-    def addSnapshot(self, snapshot):
-        self.snapshots.append(snapshot)
+    def addSnapshot(self, snapshot, time = None):
+        self.snapshots.append(snapshot, time)
         print("added")
 
-    def applySnapshots(self):
-
-        if len(self.snapshots) > self.snapshot_frame:
-            current = self.snapshots[self.snapshot_frame]
-            done = 1 - self.applyFacialSnapshot(current)
-
-            if done:
-                self.snapshot_frame += 1
+    def seek(self, t):
+        self.snapshot_time = t
+        if len(self.snapshots) > 0:
+            self.setFacialValues(self.snapshots.evaluate(t, self.interpolation).tolist())
 
-        else:
-            if len(self.snapshots) > 0:
-                self.snapshots[0].applyFacialSnapshot(self)
-                self.snapshot_frame = 0
+    def applySnapshots(self):
+        if len(self.snapshots) > 0:
+            with profiler.stage("applySnapshots"):
+                t = self.snapshot_time + self.dt
+                duration = self.snapshots.getDuration()
+                if t > duration:
+                    t = t % duration if duration > 0 else 0
+
+                self.seek(t)
+
+    def getMouthRes(self, width = None):
+        # the mouth gets a point about every mouth_spacing pixels, up to mouth_res per side
+        if width is None:
+            width = self.mouth_width
+        if self.mouth_spacing <= 0:
+            return self.mouth_res
+        width = abs(width * self.mouth_openess[0]) * self.viewer.getScale()
+        return int(min(self.mouth_res, max(2, math.ceil(width / self.mouth_spacing))))
+
+    def getMouthLods(self, values = None):
+        if values is None:
+            values = self.getFacialValues()
+        return tuple(self.getMouthRes(values[width]) for width, height, smile in self.rig.mouths.values())
+
+    def getMouthCurves(self, width, height, smile):
+        return mouthCurve(width, height, smile, self.mouth_openess, self.mouth_res)
 
     def setMouth(self):
+        with profiler.stage("setMouth"):
+            values = self.getFacialValues()
+            self.mouth_lod = self.getMouthLods(values)
+            self.dirty_parts.update(self.rig.mouths)
+            for (i, (width, height, smile)), res in zip(self.rig.mouths.items(), self.mouth_lod):
+                self.polys[i].points = self.mouth_caches[i].get(values[width], values[height], values[smile],
+                                                                self.mouth_openess, res)
 
-        res = 10
-
-        def smile(x):
-            return self.smile_amt * (x * x)
-
-        jump = 1. / res
-        indexes = np.arange(-1, 1 + jump, jump)
-        x1 = indexes * self.mouth_width * self.mouth_openess[0]
-        y1 = smile(x1) - (self.mouth_height * self.mouth_openess[1] / 2.0)
-        y2 = y1 + (self.mouth_height * self.mouth_openess[1] / 2.0)
+    def evaluateFrames(self, values):
+        return evaluateRig(self, values)
 
-        x = np.append(x1, x1[::-1])
-        y = np.append(y1, y2)
+    def bakeTimeline(self, fps = 30):
+        frames = int(self.snapshots.getDuration() * fps) + 1
+        return evaluateRig(self, self.snapshots.evaluate(np.arange(frames) / float(fps), self.interpolation))
 
-        self.mouth.points = np.array([(x[i], y[i]) for i in range(len(x))])
-        self.mouth.dir = 0
+    def getPolys(self):
+        return self.polys
 
     def start(self):
         self.t = timeit.default_timer()
+        self.scheduler.start()
 
     def update(self):
+        with profiler.stage("update"):
+            state = self.getState()
+            if state == self.state:
+                return
 
-        self.head.pos[1] = self.body.pos[1] + (((self.body.size[1] / 2.0) + self.head_escalation) * -1 )
-        self.head.pos[0] = self.body.pos[0] + self.head_shift
-
-        self.queen_body.pos = self.body.pos
-
-        self.head.setDir(self.head_rotation)
-
-        frontal_pos = midPoint(self.head.points[0], self.head.points[1])
-        side_pos = midPoint(self.head.points[1], self.head.points[2])
-
-        crown_pos = np.array(frontal_pos)
-        addMag(crown_pos, (self.crown_size / 1.4))
-        crown_pos += self.head.pos
-        self.crown.pos = crown_pos
-        self.crown.setDir(self.head_rotation)
-
-        eye_central_pos = np.array(frontal_pos)
-        eye_central_pos /= 6
-        eye_central_pos += self.head.pos
-
-        dis = 2.2
-
-        right = np.array(side_pos) / dis
-        left = np.array(side_pos) / -dis
-
-        size = (self.eye_size, self.eye_size * self.eye_openess[0])
-        self.eyes[0].points = Rect(size).getPoints()
-        self.eyes[0].dir = 0
-
-        self.eyes[0].pos = eye_central_pos + right
-        self.eyes[0].setDir(self.head_rotation)
-
-        size = (self.eye_size, self.eye_size * self.eye_openess[1])
-        self.eyes[1].points = Rect(size).getPoints()
-        self.eyes[1].dir = 0
-
-        self.eyes[1].pos = eye_central_pos + left
-        self.eyes[1].setDir(self.head_rotation)
-
-        self.setMouth()
-
-        mouth_pos = np.array(frontal_pos)
-        mouth_pos *= -self.mouth_escalation
-        mouth_pos += self.head.pos
-
-        self.mouth.pos = mouth_pos
-        self.mouth.setDir(self.head_rotation)
-
-        eb_cpr = np.array(eye_central_pos)
-        eb_cpr -= self.head.pos
-        addMag(eb_cpr, self.eb_escalations[0])
-        eb_cpr += self.head.pos
-
-        eb_cpl = np.array(eye_central_pos)
-        eb_cpl -= self.head.pos
-        addMag(eb_cpl, self.eb_escalations[1])
-        eb_cpl += self.head.pos
-
-
-        self.eye_brows[0].pos = eb_cpr + right
-        self.eye_brows[0].setDir(self.head_rotation)
-        self.eye_brows[0].rotate(self.eb_rotatioins[0])
-
-        self.eye_brows[1].pos = eb_cpl + left
-        self.eye_brows[1].setDir(self.head_rotation)
-        self.eye_brows[1].rotate(self.eb_rotatioins[1])
-
-
-        #self.head_rotation += math.pi / 3000
+            if self.state is None:
+                changed = set(STATE_FIELDS)
+            else:
+                changed = {name for name, new, old in zip(STATE_FIELDS, state, self.state) if new != old}
+
+            self.state = state
+            self.updateParts(changed)
+
+    def updateParts(self, changed):
+        shapes = {i for i, dependencies in enumerate(self.shape_dependencies) if changed & dependencies}
+        poses = {i for i, dependencies in enumerate(self.pose_dependencies) if changed & dependencies} | shapes
+        if not poses:
+            return
+        self.dirty_parts |= poses
+
+        # every part is posed in one go, only the changed ones are handed to their polys
+        angles, positions, sizes = self.rig.getTransforms(self.getFacialValues(), self.pos)
+        angles = angles[0].tolist()
+
+        for i in poses:
+            poly = self.polys[i]
+            if i in shapes and i not in self.rig.mouths:
+                poly.points = self.rig.shapes[i] * sizes[0, i]
+            poly.pos = positions[0, i]
+            poly.setDir(angles[i])
+
+        if shapes & self.rig.mouths.keys():
+            self.setMouth()
+
+    def draw(self):
+        # the mouth's detail follows its size on screen, which the camera can change without an update
+        if self.getMouthLods() != self.mouth_lod:
+            self.setMouth()
+
+        # only the parts that changed since the last draw are drawn again, returns the rects of the
+        # display that changed, [] when nothing did and None when all of it was drawn
+        dirty = self.dirty_parts
+        self.dirty_parts = set()
+        return self.viewer.redraw(self.getPolys(), dirty)
 
     def render(self):
-        self.viewer.clear()
-        self.body.pos *= 0
-        body = self.body.getPoly()
-        self.viewer.draw([self.queen_body, self.head, self.crown, self.mouth] + self.eyes + self.eye_brows)
+        self.draw()
         self.viewer.render()
 
     def edit(self):
-        self.start()
-
-        while self.control.cont:
-            self.t = timeit.default_timer()
-            self.control.update()
-            self.control.update_info()
-            self.update()
-            self.render()
-            self.dt = timeit.default_timer() - self.t
+        from Editor import edit
+        edit(self)
 
-    def play(self):
+    def play(self, frames = None):
         self.start()
-        if len(self.snapshots) > 0:
-            self.snapshots[0].applyFacialSnapshot(self)
-
-        while 1:
-            self.t = timeit.default_timer()
-            self.applySnapshots()
-            self.update()
-            self.render()
-            self.dt = timeit.default_timer() - self.t
+        self.seek(0)
+        self.dt = self.scheduler.step
+
+        while frames is None or self.scheduler.frames < frames:
+            with profiler.stage("frame"):
+                for step in range(self.scheduler.tick()):
+                    self.applySnapshots()
+                self.update()
+                self.render()
+            self.scheduler.wait()
+
+    def renderVideo(self, writer, fps = 30, frames = None):
+        # frame i shows time i / fps, never touches pygame.display so it runs without a screen
+        if frames is None:
+            frames = int(self.snapshots.getDuration() * fps) + 1 if len(self.snapshots) > 0 else 1
+
+        for frame in range(frames):
+            with profiler.stage("frame"):
+                self.seek(frame / float(fps))
+                self.update()
+                rects = self.draw()
+                with profiler.stage("write"):
+                    # a frame where nothing changed is the last one again and is not encoded
+                    if rects == [] and frame > 0:
+                        writer.repeat()
+                    else:
+                        writer.write(self.viewer.display)
+
+        return frames
 
 
         #self.world.viewer.draw([self.crown])
 
 class FacialSnapshot:
-    def __init__(self):
-        self.facial_data = {"hr": 0, "he": 0, "hs": 0, "mw": 0, "mh": 0, "me": 0, "sa": 0, "es": 0, "reo": 0, "leo": 0, "rbe": 0, "lbe": 0, "rbr": 0, "lbr": 0}
+    # values can be a row of a Timeline, in which case the snapshot is a view onto it
+    def __init__(self, values = None):
+        if values is None:
+            values = np.zeros(len(FACIAL_FIELDS))
+        self.values = values
+
+    def __getitem__(self, name):
+        return self.values[FIELD_INDEX[name]]
+
+    def __setitem__(self, name, value):
+        self.values[FIELD_INDEX[name]] = value
 
     def takeSnapshot(self, narrator):
-        #names = ["hr", "he", "hs", "mw", "mh", "me", "sa", "es", "reo", "leo", "rbe", "lbe", "rbr", "lbr"]
-        values = [narrator.head_rotation,
-                  narrator.head_escalation,
-                  narrator.head_shift,
-                  narrator.mouth_width,
-                  narrator.mouth_height,
-                  narrator.mouth_escalation,
-                  narrator.smile_amt,
-                  narrator.eye_size,
-                  narrator.eye_openess[0],
-                  narrator.eye_openess[1],
-                  narrator.eb_escalations[0],
-                  narrator.eb_escalations[1],
-                  narrator.eb_rotatioins[0],
-                  narrator.eb_rotatioins[1]]
-
-        self.setValues(values)
+        self.setValues(narrator.getFacialValues())
 
     def applyFacialSnapshot(self, narrator):
-        narrator.head_rotation = self.facial_data["hr"]
-        narrator.head_escalation = self.facial_data["he"]
-        narrator.head_shift = self.facial_data["hs"]
-        narrator.mouth_width = self.facial_data["mw"]
-        narrator.mouth_height = self.facial_data["mh"]
-        narrator.mouth_escalation = self.facial_data["me"]
-        narrator.smile_amt = self.facial_data["sa"]
-        narrator.eye_size = self.facial_data["es"]
-        narrator.eye_openess[0] = self.facial_data["reo"]
-        narrator.eye_openess[1] = self.facial_data["leo"]
-        narrator.eb_escalations[0] = self.facial_data["rbe"]
-        narrator.eb_escalations[1] = self.facial_data["lbe"]
-        narrator.eb_rotatioins[0] = self.facial_data["rbr"]
-        narrator.eb_rotatioins[1] = self.facial_data["lbr"]
+        narrator.setFacialValues(self.values.tolist())
 
     def getValues(self):
-        return np.array(list(self.facial_data.values()))
+        return self.values
 
     def setValues(self, values):
-        for value, name in zip(values, self.facial_data):
-            self.facial_data[name] = value
-
-class Control(tk.Frame):
-    def __init__(self, narrator, master=None):
-        tk.Frame.__init__(self, master, width=768, height=576, bg="", colormap="new")
-        self.grid()
-        self.narrator = narrator
-        self.createWidgets()
-        self.cont = 1
-
-        self.snap = FacialSnapshot()
-        self.snap.takeSnapshot(self.narrator)
-
-    def takeSnapshot(self):
-        self.snap = self.narrator.takeFacialSnapshot()
-
-    def applySnapshot(self):
-        self.narrator.addSnapshot(self.snap)
-
-    def quit(self):
-        self.cont = 0
-
-    def createWidgets(self):
-
-        self.div0 = tk.Label(self, text = "\nHead" )
-
-        self.hr_scale = tk.Scale(self, from_=-math.pi / 2., to=math.pi / 2., orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.hr_label = tk.Label(self, text = "Head Rotation" )
-        self.he_scale = tk.Scale(self, from_=0, to=2, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.he_label = tk.Label(self, text = "Head Elavation" )
-        self.hs_scale = tk.Scale(self, from_=-1, to=1, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.hs_label = tk.Label(self, text = "Head Shift" )
-
-        self.div1 = tk.Label(self, text = "\nMouth" )
-
-        self.mw_scale = tk.Scale(self, from_=.05, to=.5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.mw_label = tk.Label(self, text = "Mouth Width" )
-        self.mh_scale = tk.Scale(self, from_=.05, to=.5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.mh_label = tk.Label(self, text = "Mouth Height" )
-        self.me_scale = tk.Scale(self, from_= .5, to= 1.5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.me_label = tk.Label(self, text = "Mouth Escalation" )
-        self.sa_scale = tk.Scale(self, from_= -2, to= 2, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.sa_label = tk.Label(self, text = "Smile Amt" )
-
-        self.div2 = tk.Label(self, text = "\nEyes" )
-
-        self.es_scale = tk.Scale(self, from_= .1, to= .5, orient=tk.HORIZONTAL, length = 400, resolution=0.001)
-        self.es_label =  tk.Label(self, text = "Eye Size" )
-        self.eor_scale = tk.Scale(self, from_= .1, to= 1.5, orient=tk.HORIZONTAL, length = 400, resolution=0.001)
-        self.eor_label = tk.Label(self, text = "Right Eye Openess" )
-        self.eol_scale = tk.Scale(self, from_= .1, to= 1.5, orient=tk.HORIZONTAL, length = 400, resolution=0.001)
-        self.eol_label = tk.Label(self, text = "Left Eye Openess" )
-
-        self.div3 = tk.Label(self, text = "\nEye Brows" )
-
-        self.ber_scale = tk.Scale(self, from_= 0, to= .5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.ber_label = tk.Label(self, text = "Right Eye Brow Escalation" )
-        self.bel_scale = tk.Scale(self, from_= 0, to= .5, orient=tk.HORIZONTAL, length = 400, resolution=0.01)
-        self.bel_label = tk.Label(self, text = "Left Eye Brow Escalation" )
-        self.brr_scale = tk.Scale(self, from_= -math.pi / 6., to= math.pi / 6., orient=tk.HORIZONTAL, length = 400, resolution=.01)
-        self.brr_label = tk.Label(self, text = "Right Eye Brow Rotation" )
-        self.brl_scale = tk.Scale(self, from_= math.pi / 6., to= -math.pi / 6., orient=tk.HORIZONTAL, length = 400, resolution=.01)
-        self.brl_label = tk.Label(self, text = "Left Eye Brow Rotation" )
-
-        self.div4 = tk.Label(self, text = "\n" )
-
-        self.applySnapshot = tk.Button(self, text='addSnapshot', command=self.applySnapshot)
-        self.takeSnapshot = tk.Button(self, text='takeSnapshot', command=self.takeSnapshot)
-        self.quitButton = tk.Button(self, text='Quit', command=self.quit)
-
-        self.div0.grid(row=0, column=1)
-
-        self.hr_scale.grid(row=1, column=1)
-        self.hr_label.grid(row=1, column=0)
-        self.he_scale.grid(row=2, column=1)
-        self.he_label.grid(row=2, column=0)
-        self.hs_scale.grid(row=3, column=1)
-        self.hs_label.grid(row=3, column=0)
-
-        self.div1.grid(row=4, column=1)
-
-        self.mw_scale.grid(row=5, column=1)
-        self.mw_label.grid(row=5, column=0)
-        self.mh_scale.grid(row=6, column=1)
-        self.mh_label.grid(row=6, column=0)
-        self.me_scale.grid(row=7, column=1)
-        self.me_label.grid(row=7, column=0)
-        self.sa_scale.grid(row=8, column=1)
-        self.sa_label.grid(row=8, column=0)
-
-        self.div2.grid(row=9, column=1)
-
-        self.es_scale.grid(row=10, column=1)
-        self.es_label.grid(row=10, column=0)
-        self.eor_scale.grid(row=11, column=1)
-        self.eor_label.grid(row=11, column=0)
-        self.eol_scale.grid(row=12, column=1)
-        self.eol_label.grid(row=12, column=0)
-
-        self.div3.grid(row=13, column=1)
-
-        self.ber_scale.grid(row=14, column=1)
-        self.ber_label.grid(row=14, column=0)
-        self.bel_scale.grid(row=15, column=1)
-        self.bel_label.grid(row=15, column=0)
-        self.brr_scale.grid(row=16, column=1)
-        self.brr_label.grid(row=16, column=0)
-        self.brl_scale.grid(row=17, column=1)
-        self.brl_label.grid(row=17, column=0)
-
-        self.div4.grid(row=18, column=0)
-
-        self.takeSnapshot.grid(row=19, column=0)
-        self.applySnapshot.grid(row=19, column=1)
-        self.quitButton.grid(row=19, column=2)
-
-        self.set_vals()
-
-    def set_vals(self):
-        self.hr_scale.set(self.narrator.head_rotation)
-        self.he_scale.set(self.narrator.head_escalation)
-        self.hs_scale.set(self.narrator.head_shift)
-        self.mw_scale.set(self.narrator.mouth_width)
-        self.mh_scale.set(self.narrator.mouth_height)
-        self.me_scale.set(self.narrator.mouth_escalation)
-        self.sa_scale.set(self.narrator.smile_amt)
-        self.es_scale.set(self.narrator.eye_size)
-        self.eor_scale.set(self.narrator.eye_openess[0])
-        self.eol_scale.set(self.narrator.eye_openess[1])
-        self.ber_scale.set(self.narrator.eb_escalations[0])
-        self.bel_scale.set(self.narrator.eb_escalations[1])
-        self.brr_scale.set(self.narrator.eb_rotatioins[0])
-        self.brl_scale.set(self.narrator.eb_rotatioins[1])
-
-        #self.update()
-        #self.after(10, self.update_info)
-
-    def update_info(self):
-        #print("here")
-        self.narrator.head_rotation = self.hr_scale.get()
-        self.narrator.head_escalation = self.he_scale.get()
-        self.narrator.head_shift = self.hs_scale.get()
-        self.narrator.mouth_width = self.mw_scale.get()
-        self.narrator.mouth_height = self.mh_scale.get()
-        self.narrator.mouth_escalation = self.me_scale.get()
-        self.narrator.smile_amt = self.sa_scale.get()
-        self.narrator.eye_size = self.es_scale.get()
-        self.narrator.eye_openess[0] = self.eor_scale.get()
-        self.narrator.eye_openess[1] = self.eol_scale.get()
-        self.narrator.eb_escalations[0] = self.ber_scale.get()
-        self.narrator.eb_escalations[1] = self.bel_scale.get()
-        self.narrator.eb_rotatioins[0] = self.brr_scale.get()
-        self.narrator.eb_rotatioins[1] = self.brl_scale.get()
-
-        #self.after(10, self.update_info)
-
-qn = Narrator()
-qn.edit()
-print("end")
-qn.play()
+        self.values[:] = values
+
+# binary timeline: a 32 byte header (magic, version, field count, dtype, frame count)
+# followed by the frame times as float64 (since version 2) and the frames x fields values,
+# so both can be memory mapped in place
+TIMELINE_MAGIC = b"SNTL"
+TIMELINE_VERSION = 2
+TIMELINE_HEADER = struct.Struct("<4sHHcxxxQ")
+TIMELINE_HEADER_SIZE = 32
+
+INTERPOLATIONS = ("linear", "eased", "cubic")
+
+class Timeline:
+    def __init__(self, values = None, times = None, dtype = np.float64, spacing = 1.):
+        if values is None:
+            values = np.empty((0, len(FACIAL_FIELDS)), dtype=dtype)
+        if times is None:
+            times = np.arange(len(values)) * spacing
+        if len(times) != len(values):
+            raise ValueError("got %d times for %d snapshots" % (len(times), len(values)))
+
+        self.data = values
+        self.time_data = np.asarray(times, dtype=np.float64)
+        self.count = len(values)
+        self.spacing = spacing
+
+    @staticmethod
+    def fromSnapshots(snapshots, times = None, spacing = 1.):
+        values = np.array([snapshot.getValues() for snapshot in snapshots], dtype=np.float64).reshape((-1, len(FACIAL_FIELDS)))
+        return Timeline(values, times, spacing=spacing)
+
+    @property
+    def values(self):
+        return self.data[:self.count]
+
+    @property
+    def times(self):
+        return self.time_data[:self.count]
+
+    def getDuration(self):
+        # the time of the last snapshot, frames are seeked from 0 and the pose before the first
+        # snapshot is the first one held
+        if self.count == 0:
+            return 0.
+        return float(self.time_data[self.count - 1])
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.values[:, FIELD_INDEX[key]]
+
+        return FacialSnapshot(self.values[key])
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+    def append(self, snapshot, time = None):
+        if time is None:
+            time = self.time_data[self.count - 1] + self.spacing if self.count > 0 else 0.
+        elif self.count > 0 and time < self.time_data[self.count - 1]:
+            raise ValueError("snapshot at %g is before the end of the timeline" % time)
+
+        self.reserve(self.count + 1)
+        self.data[self.count] = snapshot.getValues()
+        self.time_data[self.count] = time
+        self.count += 1
+
+    def extend(self, values, times):
+        # appends a (frames, 14) array of values at once, times has to be sorted
+        values = np.asarray(values).reshape((-1, len(FACIAL_FIELDS)))
+        times = np.asarray(times, dtype=np.float64)
+        if len(times) != len(values):
+            raise ValueError("got %d times for %d snapshots" % (len(times), len(values)))
+        if len(times) == 0:
+            return
+        if np.any(np.diff(times) < 0) or (self.count > 0 and times[0] < self.time_data[self.count - 1]):
+            raise ValueError("snapshots have to be added in time order")
+
+        self.reserve(self.count + len(values))
+        self.data[self.count:self.count + len(values)] = values
+        self.time_data[self.count:self.count + len(values)] = times
+        self.count += len(values)
+
+    def reserve(self, count):
+        # grows the arrays by doubling, a memory mapped timeline is copied on the first change
+        if count <= len(self.data) and self.data.flags.writeable:
+            return
+
+        size = max(16, len(self.data) * 2, count)
+        data = np.empty((size, len(FACIAL_FIELDS)), dtype=self.dtype)
+        data[:self.count] = self.values
+        times = np.empty(size)
+        times[:self.count] = self.times
+        self.data = data
+        self.time_data = times
+
+    def seek(self, t):
+        # index of the keyframe starting the segment t falls in
+        i = np.searchsorted(self.times, t, side="right") - 1
+        return np.clip(i, 0, max(self.count - 2, 0))
+
+    def evaluate(self, t, mode = "linear"):
+        if mode not in INTERPOLATIONS:
+            raise ValueError("unknown interpolation %r" % mode)
+        if self.count == 0:
+            raise ValueError("can not evaluate an empty timeline")
+
+        values = self.values
+        times = self.times
+        t = np.clip(np.asarray(t, dtype=np.float64), times[0], times[-1])
+        if self.count == 1:
+            return np.broadcast_to(values[0], t.shape + values[0].shape).astype(np.float64)
+
+        i = self.seek(t)
+        span = times[i + 1] - times[i]
+        u = np.where(span > 0, (t - times[i]) / np.where(span > 0, span, 1.), 1.)[..., None]
+
+        p0 = values[i].astype(np.float64)
+        p1 = values[i + 1].astype(np.float64)
+
+        if mode == "linear":
+            return p0 + ((p1 - p0) * u)
+
+        if mode == "eased":
+            return p0 + ((p1 - p0) * (u * u * (3 - (2 * u))))
+
+        # catmull-rom through the neighbouring keyframes
+        pm = values[np.maximum(i - 1, 0)].astype(np.float64)
+        p2 = values[np.minimum(i + 2, self.count - 1)].astype(np.float64)
+        return .5 * ((2 * p0) +
+                     ((p1 - pm) * u) +
+                     (((2 * pm) - (5 * p0) + (4 * p1) - p2) * u * u) +
+                     (((3 * p0) - pm - (3 * p1) + p2) * u * u * u))
+
+    def save(self, file):
+        values = np.ascontiguousarray(self.values, dtype=self.dtype.newbyteorder("<"))
+        header = TIMELINE_HEADER.pack(TIMELINE_MAGIC, TIMELINE_VERSION, len(FACIAL_FIELDS), self.dtype.char.encode(), self.count)
+
+        with open(file, "wb") as f:
+            f.write(header.ljust(TIMELINE_HEADER_SIZE, b"\0"))
+            f.write(np.ascontiguousarray(self.times, dtype="<f8").tobytes())
+            f.write(values.tobytes())
+
+    @staticmethod
+    def load(file, mmap = True):
+        with open(file, "rb") as f:
+            header = f.read(TIMELINE_HEADER_SIZE)
+
+        if len(header) < TIMELINE_HEADER_SIZE:
+            raise ValueError("%s is not a timeline file" % file)
+
+        magic, version, fields, dtype, count = TIMELINE_HEADER.unpack(header[:TIMELINE_HEADER.size])
+        if magic != TIMELINE_MAGIC:
+            raise ValueError("%s is not a timeline file" % file)
+        if version not in (1, TIMELINE_VERSION):
+            raise ValueError("unsupported timeline version %d" % version)
+        if fields != len(FACIAL_FIELDS):
+            raise ValueError("timeline has %d fields, expected %d" % (fields, len(FACIAL_FIELDS)))
+
+        dtype = np.dtype(dtype.decode()).newbyteorder("<")
+        if count == 0:
+            return Timeline(dtype=dtype)
+
+        # version 1 files have no times, their snapshots are a second apart
+        offset = TIMELINE_HEADER_SIZE
+        times = None
+        if version >= 2:
+            if mmap:
+                times = np.memmap(file, dtype="<f8", mode="r", offset=offset, shape=(count,))
+            else:
+                times = np.fromfile(file, dtype="<f8", count=count, offset=offset)
+            offset += count * 8
+
+        if mmap:
+            values = np.memmap(file, dtype=dtype, mode="r", offset=offset, shape=(count, fields))
+        else:
+            values = np.fromfile(file, dtype=dtype, count=count * fields, offset=offset).reshape((count, fields))
+
+        return Timeline(values, times)
+
+class TimelineWriter:
+    # writes a timeline file chunk by chunk without holding it in memory, the times go straight to
+    # the file and the values to a temporary file that is copied behind them on close
+    def __init__(self, file, dtype = np.float64):
+        self.file = open(file, "wb")
+        self.dtype = np.dtype(dtype)
+        self.values = tempfile.TemporaryFile()
+        self.count = 0
+        self.last = -np.inf
+        self.writeHeader()
+
+    def writeHeader(self):
+        header = TIMELINE_HEADER.pack(TIMELINE_MAGIC, TIMELINE_VERSION, len(FACIAL_FIELDS), self.dtype.char.encode(), self.count)
+        self.file.write(header.ljust(TIMELINE_HEADER_SIZE, b"\0"))
+
+    def extend(self, values, times):
+        values = np.asarray(values).reshape((-1, len(FACIAL_FIELDS)))
+        times = np.asarray(times, dtype=np.float64)
+        if len(times) != len(values):
+            raise ValueError("got %d times for %d snapshots" % (len(times), len(values)))
+        if len(times) == 0:
+            return
+        if np.any(np.diff(times) < 0) or times[0] < self.last:
+            raise ValueError("snapshots have to be added in time order")
+
+        self.file.write(np.ascontiguousarray(times, dtype="<f8").tobytes())
+        self.values.write(np.ascontiguousarray(values, dtype=self.dtype.newbyteorder("<")).tobytes())
+        self.count += len(times)
+        self.last = times[-1]
+
+    def close(self):
+        self.values.seek(0)
+        shutil.copyfileobj(self.values, self.file)
+        self.values.close()
+        self.file.seek(0)
+        self.writeHeader()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+def getWriter(out, format, size, fps):
+    from Render import RawWriter, Y4MWriter, PNGWriter
+
+    if format is None:
+        format = "y4m" if out.endswith(".y4m") else "raw" if out.endswith(".rgb") or out == "-" else "png"
+    if format == "y4m":
+        return Y4MWriter(sys.stdout.buffer if out == "-" else out, size, fps)
+    if format == "raw":
+        return RawWriter(sys.stdout.buffer if out == "-" else out)
+    return PNGWriter(out)
+
+def parseSize(size):
+    w, h = size.lower().split("x")
+    return (int(w), int(h))
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog = "narrator", description = "smart narrator")
+    commands = parser.add_subparsers(dest = "command")
+
+    edit = commands.add_parser("edit", help = "edit a narrator with the tk controls")
+    edit.add_argument("timeline", nargs = "?", help = "timeline to load and add snapshots to")
+    edit.add_argument("-o", "--out", help = "save the snapshots to this file when the editor is closed")
+
+    play = commands.add_parser("play", help = "play a timeline in a window")
+    play.add_argument("timeline")
+    play.add_argument("--fps", type = int, default = 60)
+    play.add_argument("--frames", type = int)
+
+    render = commands.add_parser("render", help = "render a timeline without a display")
+    render.add_argument("timeline")
+    render.add_argument("out", help = "a .y4m or .rgb file, - for stdout or a directory of pngs")
+    render.add_argument("-f", "--format", choices = ("y4m", "raw", "png"))
+    render.add_argument("-s", "--size", type = parseSize, default = (800, 800), help = "WxH")
+    render.add_argument("--fps", type = int, default = 30)
+    render.add_argument("--frames", type = int)
+    render.add_argument("-j", "--workers", type = int, default = 1, help = "render processes, 0 for one per core")
+    render.add_argument("-i", "--interpolation", choices = INTERPOLATIONS, default = "linear")
+    render.add_argument("-b", "--backend", choices = ("pygame", "numpy"), default = "pygame")
+    render.add_argument("--aa", type = int, default = 1, help = "samples per pixel along each axis with the numpy backend")
+    render.add_argument("--memory", type = int, default = 1024, help = "MB of rendered frames -j may hold before they are written")
+
+    compile = commands.add_parser("compile", help = "compile a transcript into a timeline of visemes")
+    compile.add_argument("transcript", help = "plain text, or start end word lines with --timed")
+    compile.add_argument("out")
+    compile.add_argument("-t", "--timed", action = "store_true", help = "the transcript has word timings")
+    compile.add_argument("--rate", type = float, default = 14., help = "letters per second of plain text")
+
+    serve = commands.add_parser("serve", help = "render frames live from parameters sent over a socket")
+    serve.add_argument("--host", default = "127.0.0.1")
+    serve.add_argument("--port", type = int, default = 8765)
+    serve.add_argument("-s", "--size", type = parseSize, default = (800, 800), help = "WxH")
+    serve.add_argument("--fps", type = int, default = 30)
+    serve.add_argument("-f", "--format", choices = ("raw", "png"), default = "raw")
+    serve.add_argument("-b", "--backend", choices = ("pygame", "numpy"), default = "numpy")
+    serve.add_argument("--aa", type = int, default = 1)
+
+    commands.add_parser("bench", help = "run the benchmarks, see bench -h", add_help = False)
+    commands.add_parser("golden", help = "record or check golden frames, see golden -h", add_help = False)
+
+    args, rest = parser.parse_known_args(args)
+
+    if args.command == "bench":
+        import Bench
+        return Bench.main(rest)
+    if args.command == "golden":
+        import Golden
+        return Golden.main(rest)
+    if rest:
+        parser.error("unrecognized arguments: " + " ".join(rest))
+
+    if args.command is None:
+        qn = Narrator()
+        qn.edit()
+        print("end")
+        qn.play()
+
+    elif args.command == "edit":
+        qn = Narrator()
+        if args.timeline:
+            # read into memory since it may be saved back over the same file
+            qn.snapshots = Timeline.load(args.timeline, mmap = False)
+        qn.edit()
+        if args.out:
+            qn.saveSnapshot(args.out)
+
+    elif args.command == "play":
+        qn = Narrator(fps = args.fps)
+        qn.loadSnapshot(args.timeline)
+        qn.play(args.frames)
+
+    elif args.command == "render":
+        # the timeline is read before the writer truncates the output, so a wrong path leaves it alone
+        try:
+            timeline = Timeline.load(args.timeline)
+        except (OSError, ValueError) as e:
+            parser.error("can not read the timeline %s: %s" % (args.timeline, e))
+
+        with getWriter(args.out, args.format, args.size, args.fps) as writer:
+            if args.workers == 1:
+                qn = Narrator(headless = True, size = args.size, backend = args.backend, aa = args.aa)
+                qn.interpolation = args.interpolation
+                qn.snapshots = timeline
+                qn.renderVideo(writer, args.fps, args.frames)
+            else:
+                from Render import renderParallel
+                renderParallel(timeline, writer, args.size, args.fps, args.frames,
+                               args.workers or None, interpolation = args.interpolation,
+                               backend = args.backend, aa = args.aa, memory = args.memory << 20)
+
+    elif args.command == "compile":
+        from Visemes import compileTimeline, readTimedWords, timeWords
+
+        with open(args.transcript) as f, TimelineWriter(args.out) as out:
+            words = readTimedWords(f) if args.timed else timeWords(f, args.rate)
+            compileTimeline(words, Narrator(headless = True, size = (1, 1), backend = "numpy").getFacialValues(), out)
+
+    elif args.command == "serve":
+        import asyncio
+        from Server import NarratorServer
+
+        qn = Narrator(headless = True, size = args.size, backend = args.backend, aa = args.aa)
+        server = NarratorServer(qn, args.host, args.port, args.fps, args.format)
+        try:
+            asyncio.run(server.serve())
+        except KeyboardInterrupt:
+            pass
+
+    return 0
+
+if __name__ == "__main__":
+    # run through the imported module so the editor and workers share its classes
+    import Narrator
+    sys.exit(Narrator.main())
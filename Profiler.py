@@ -0,0 +1,120 @@
+from collections import deque
+import numpy as np
+import json
+import timeit
+
+# frame time histogram bucket edges in milliseconds
+FRAME_BUCKETS = np.array([1., 2., 4., 8., 16.7, 33.3, 50., 100.])
+
+class RollingTimer:
+    def __init__(self, size = 1024):
+        self.values = np.zeros(size)
+        self.index = 0
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value):
+        self.values[self.index] = value
+        self.index = (self.index + 1) % len(self.values)
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def getRecent(self):
+        return self.values[:min(self.count, len(self.values))]
+
+    def getStats(self):
+        recent = self.getRecent()
+        p50, p95, p99 = np.percentile(recent, [50, 95, 99]) if len(recent) else (0., 0., 0.)
+        ms = 1000.
+        return {"count": self.count,
+                "mean_ms": self.total / self.count * ms if self.count else 0.,
+                "p50_ms": p50 * ms,
+                "p95_ms": p95 * ms,
+                "p99_ms": p99 * ms,
+                "max_ms": self.max * ms}
+
+class Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = timeit.default_timer()
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, self.start, timeit.default_timer())
+
+class NullStage:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *args):
+        pass
+
+NULL_STAGE = NullStage()
+
+class Profiler:
+    # while disabled stage() hands back a shared no-op context, so the timers cost a call when off
+    def __init__(self, size = 1024, trace_size = 100000):
+        self.enabled = False
+        self.size = size
+        self.timers = {}
+        self.frame_counts = np.zeros(len(FRAME_BUCKETS) + 1, dtype=np.int64)
+        self.events = deque(maxlen=trace_size)
+        self.origin = timeit.default_timer()
+
+    def enable(self, enabled = True):
+        self.enabled = enabled
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        self.timers = {}
+        self.frame_counts[:] = 0
+        self.events.clear()
+        self.origin = timeit.default_timer()
+
+    def stage(self, name):
+        if not self.enabled:
+            return NULL_STAGE
+        return Stage(self, name)
+
+    def record(self, name, start, end):
+        timer = self.timers.get(name)
+        if timer is None:
+            timer = self.timers[name] = RollingTimer(self.size)
+
+        duration = end - start
+        timer.add(duration)
+        if name == "frame":
+            self.frame_counts[np.searchsorted(FRAME_BUCKETS, duration * 1000.)] += 1
+
+        self.events.append((name, start, duration))
+
+    def getStats(self):
+        labels = ["<%gms" % edge for edge in FRAME_BUCKETS] + [">=%gms" % FRAME_BUCKETS[-1]]
+        return {"stages": {name: timer.getStats() for name, timer in self.timers.items()},
+                "frame_histogram": dict(zip(labels, self.frame_counts.tolist()))}
+
+    def getChromeTrace(self):
+        us = 1000000.
+        return {"traceEvents": [{"name": name, "ph": "X", "pid": 0, "tid": 0,
+                                 "ts": (start - self.origin) * us, "dur": duration * us}
+                                for name, start, duration in self.events],
+                "displayTimeUnit": "ms"}
+
+    def saveJSON(self, file):
+        with open(file, "w") as f:
+            json.dump(self.getStats(), f, indent = 2)
+
+    def saveChromeTrace(self, file):
+        with open(file, "w") as f:
+            json.dump(self.getChromeTrace(), f)
+
+profiler = Profiler()
@@ -0,0 +1,157 @@
+import numpy as np
+
+def clamp(values, high):
+    # np.clip without its dispatch overhead, which adds up over many small polygons
+    return np.minimum(np.maximum(values, 0), high)
+
+def getSpans(points, height):
+    # the even-odd spans of a polygon on every scanline through pixel centers, as
+    # rows, starts and ends with the starts and ends in pixel coordinates
+    x0 = points[:, 0]
+    y0 = points[:, 1]
+    ends = np.concatenate((points[1:], points[:1]))
+    x1 = ends[:, 0]
+    y1 = ends[:, 1]
+
+    # an edge crosses the scanline of row r when r + .5 is in [min y, max y)
+    first = clamp(np.ceil(np.minimum(y0, y1) - .5), height).astype(np.int64)
+    last = clamp(np.ceil(np.maximum(y0, y1) - .5), height).astype(np.int64)
+    counts = last - first
+
+    edges = np.repeat(np.arange(len(points)), counts)
+    offsets = np.cumsum(counts) - counts
+    rows = np.arange(len(edges)) - offsets[edges] + first[edges]
+
+    t = (rows + .5 - y0[edges]) / (y1[edges] - y0[edges])
+    xs = x0[edges] + (t * (x1[edges] - x0[edges]))
+
+    # every scanline crosses a closed polygon an even number of times
+    order = np.lexsort((xs, rows))
+    rows = rows[order]
+    xs = xs[order]
+
+    return rows[0::2], xs[0::2], xs[1::2]
+
+def getColumns(starts, ends, w):
+    # the pixels whose centers are in [start, end)
+    starts = clamp(np.ceil(starts - .5), w).astype(np.int64)
+    ends = clamp(np.ceil(ends - .5), w).astype(np.int64)
+    return starts, ends
+
+def getCoverage(points, size, aa):
+    # the share of every pixel of a size (w, h) image inside the polygon, sampled on aa scanlines
+    # per pixel row with the exact horizontal coverage of every span, as the top left corner of
+    # the polygon's bounding box and the coverage of that box
+    w, h = size
+    rows, starts, ends = getSpans(points * (1., aa), h * aa)
+    if len(rows) == 0:
+        return 0, 0, np.zeros((0, 0), dtype=np.float32)
+
+    rows = rows // aa
+    starts = clamp(starts, w)
+    ends = clamp(ends, w)
+    first = np.floor(starts)
+    last = np.floor(ends)
+
+    left = int(first.min())
+    top = int(rows[0])
+    width = int(last.max()) - left + 1
+    height = int(rows[-1]) - top + 1
+
+    # a span [a, b) covers the pixels from floor(a) up to floor(b) fully, less the part of
+    # floor(a) before a and plus the part of floor(b) before b, the full pixels are a running
+    # sum of +1 and -1 steps along the row and the partial ones are added on top
+    base = ((rows - top) * width) - left
+    indexes = np.concatenate((base + first.astype(np.int64), base + last.astype(np.int64)))
+    ones = np.ones(len(rows))
+    steps = np.bincount(indexes, np.concatenate((ones, -ones)), width * height)
+    parts = np.bincount(indexes, np.concatenate((first - starts, ends - last)), width * height)
+
+    coverage = np.cumsum(steps.reshape((height, width)), axis=1)
+    coverage += parts.reshape((height, width))
+    coverage *= 1. / aa
+    return top, left, coverage.astype(np.float32)
+
+class Canvas:
+    # a pygame like drawing target that rasterizes straight into an (h, w, 3) uint8 array,
+    # self.buffer is reused every frame and can be handed to writers without a copy
+    def __init__(self, size = (800, 800), aa = 1):
+        w, h = size
+        self.buffer = np.zeros((h, w, 3), dtype=np.uint8)
+
+        # samples per pixel along each axis, 1 draws aliased polygons
+        self.aa = aa
+        self.rows = {}
+
+        # drawing only changes the pixels in [x0, x1) x [y0, y1)
+        self.clip = (0, 0, w, h)
+
+    # the same name as pygame.Surface so code sizing things by the display works on both
+    def get_size(self):
+        return (self.buffer.shape[1], self.buffer.shape[0])
+
+    def set_clip(self, rect = None):
+        # like pygame.Surface.set_clip, an (x, y, w, h) rect or None for the whole canvas
+        w, h = self.get_size()
+        if rect is None:
+            self.clip = (0, 0, w, h)
+        else:
+            x, y, rw, rh = rect
+            self.clip = (min(max(x, 0), w), min(max(y, 0), h), min(max(x + rw, 0), w), min(max(y + rh, 0), h))
+
+    def getRow(self, color):
+        # a whole row of pixels in this color, spans are filled by copying slices of it
+        color = tuple(color)
+        row = self.rows.get(color)
+        if row is None:
+            row = self.rows[color] = np.tile(np.array(color, dtype=np.uint8), self.buffer.shape[1])
+        return row
+
+    def fill(self, color):
+        # broadcasting a color over every pixel is slow, so the first row is filled and copied down
+        x0, y0, x1, y1 = self.clip
+        if y1 <= y0 or x1 <= x0:
+            return
+        region = self.buffer[y0:y1, x0:x1]
+        region[0].reshape(-1)[...] = self.getRow(color)[:(x1 - x0) * 3]
+        region[1:] = region[0]
+
+    def polygon(self, color, points):
+        points = np.asarray(points, dtype=np.float64).reshape((-1, 2))
+        if len(points) < 3:
+            return
+
+        if self.aa <= 1:
+            # every span is one contiguous copy into the flat buffer
+            w, h = self.get_size()
+            x0, y0, x1, y1 = self.clip
+            rows, starts, ends = getSpans(points, h)
+            if (x0, y0, x1, y1) != (0, 0, w, h):
+                inside = (rows >= y0) & (rows < y1)
+                rows, starts, ends = rows[inside], starts[inside], ends[inside]
+            starts, ends = getColumns(starts, ends, w)
+            starts = np.maximum(starts, x0)
+            ends = np.minimum(ends, x1)
+            starts = ((rows * w) + starts) * 3
+            ends = ((rows * w) + ends) * 3
+
+            flat = self.buffer.reshape(-1)
+            row = self.getRow(color)
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                if end > start:
+                    flat[start:end] = row[:end - start]
+            return
+
+        # anti aliased polygons are blended into the buffer by their coverage
+        top, left, coverage = getCoverage(points, self.get_size(), self.aa)
+        x0, y0, x1, y1 = self.clip
+        first, last = max(top, y0), min(top + coverage.shape[0], y1)
+        start, end = max(left, x0), min(left + coverage.shape[1], x1)
+        if last <= first or end <= start:
+            return
+        coverage = coverage[first - top:last - top, start - left:end - left, None]
+        region = self.buffer[first:last, start:end]
+
+        blend = region + ((np.asarray(color, dtype=np.float32) - region) * coverage)
+        np.rint(blend, out=blend)
+        region[...] = blend
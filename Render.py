@@ -0,0 +1,161 @@
+from concurrent.futures import ProcessPoolExecutor
+from collections import deque
+import numpy as np
+import io
+import os
+
+from Narrator import Narrator, Timeline, pygame
+from Raster import Canvas
+
+def surfaceToRGB(surface):
+    # a Raster.Canvas already is an (h, w, 3) array and is returned without a copy
+    if isinstance(surface, Canvas):
+        return surface.buffer
+
+    w, h = surface.get_size()
+    return np.frombuffer(pygame.image.tobytes(surface, "RGB"), dtype=np.uint8).reshape((h, w, 3))
+
+class RawWriter:
+    def __init__(self, file):
+        self.file = open(file, "wb") if isinstance(file, str) else file
+        self.frames = 0
+        self.last = None
+
+    @staticmethod
+    def encode(surface):
+        # a canvas is written straight from its buffer, the result is only valid until the next frame
+        if isinstance(surface, Canvas):
+            return surface.buffer.data
+        return pygame.image.tobytes(surface, "RGB")
+
+    def writeFrame(self, data):
+        self.file.write(data)
+        self.last = data
+        self.frames += 1
+
+    def write(self, surface):
+        self.writeFrame(self.encode(surface))
+
+    def repeat(self):
+        # the last frame again without encoding it, a frame of a canvas is only valid while the
+        # canvas is unchanged
+        self.writeFrame(self.last)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class Y4MWriter(RawWriter):
+    # full frame 4:4:4 BT.601 so no chroma subsampling is needed
+    yuv = np.array([[65.481, 128.553, 24.966],
+                    [-37.797, -74.203, 112.0],
+                    [112.0, -93.786, -18.214]]) / 255.
+    offset = np.array([16., 128., 128.])
+
+    def __init__(self, file, size = (800, 800), fps = 30):
+        RawWriter.__init__(self, file)
+        self.file.write(("YUV4MPEG2 W%d H%d F%d:1 Ip A1:1 C444\n" % (size[0], size[1], fps)).encode())
+
+    @staticmethod
+    def encode(surface):
+        rgb = surfaceToRGB(surface)
+        yuv = np.tensordot(Y4MWriter.yuv, rgb, axes=([1], [2])) + Y4MWriter.offset[:, None, None]
+        planes = np.clip(np.rint(yuv), 0, 255).astype(np.uint8)
+        return b"FRAME\n" + planes.tobytes()
+
+class PNGWriter(RawWriter):
+    def __init__(self, directory, name = "frame%06d.png"):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, name)
+        self.frames = 0
+        self.last = None
+
+    @staticmethod
+    def encode(surface):
+        if isinstance(surface, Canvas):
+            surface = pygame.image.frombuffer(surface.buffer, surface.get_size(), "RGB")
+        buffer = io.BytesIO()
+        pygame.image.save(surface, buffer, "frame.png")
+        return buffer.getvalue()
+
+    def writeFrame(self, data):
+        with open(self.path % self.frames, "wb") as file:
+            file.write(data)
+        self.last = data
+        self.frames += 1
+
+    def close(self):
+        pass
+
+# every worker process keeps its own headless narrator and offscreen surface
+worker = None
+
+def startWorker(size, encoder, interpolation, backend = "pygame", aa = 1):
+    global worker
+    worker = (Narrator(headless = True, size = size, backend = backend, aa = aa), encoder)
+    worker[0].interpolation = interpolation
+
+def renderChunk(values):
+    narrator, encoder = worker
+    frames = []
+    for row in values:
+        narrator.setFacialValues(row.tolist())
+        narrator.update()
+        if narrator.draw() == [] and frames:
+            # an unchanged frame is the same bytes again, which are also only pickled once
+            frames.append(frames[-1])
+            continue
+        # frames outlive the canvas buffer they may point into
+        frames.append(bytes(encoder(narrator.viewer.display)))
+
+    return frames
+
+def getChunks(timeline, fps, frames, chunk, interpolation):
+    for start in range(0, frames, chunk):
+        times = np.arange(start, min(start + chunk, frames)) / float(fps)
+        yield timeline.evaluate(times, interpolation)
+
+def renderParallel(timeline, writer, size = (800, 800), fps = 30, frames = None, workers = None, chunk = None, interpolation = "linear",
+                   backend = "pygame", aa = 1, memory = 1 << 30):
+    if not isinstance(timeline, Timeline):
+        timeline = Timeline.fromSnapshots(timeline)
+    if len(timeline) == 0:
+        raise ValueError("can not render an empty timeline")
+    if frames is None:
+        frames = int(timeline.getDuration() * fps) + 1
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    # the finished chunks waiting to be written hold about memory bytes of encoded frames at most,
+    # a raw frame being the largest, chunks get shorter for large frames so every worker can still
+    # have two in flight, and fewer are in flight when even single frames do not fit
+    frame_size = size[0] * size[1] * 3
+    if chunk is None:
+        chunk = max(1, min(16, memory // (frame_size * workers * 2)))
+    in_flight = max(1, min(workers * 2, memory // (frame_size * chunk)))
+
+    # chunks are written in the order they were submitted
+    pending = deque()
+    chunks = getChunks(timeline, fps, frames, chunk, interpolation)
+    written = 0
+
+    with ProcessPoolExecutor(workers, initializer = startWorker, initargs = (size, type(writer).encode, interpolation, backend, aa)) as pool:
+        for values in chunks:
+            if len(pending) >= in_flight:
+                for frame in pending.popleft().result():
+                    writer.writeFrame(frame)
+                    written += 1
+
+            pending.append(pool.submit(renderChunk, values))
+
+        while pending:
+            for frame in pending.popleft().result():
+                writer.writeFrame(frame)
+                written += 1
+
+    return written
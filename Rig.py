@@ -0,0 +1,212 @@
+import json
+import numpy as np
+import os
+
+# the character every Narrator is built from unless it is given another rig file
+QUEEN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "queen.json")
+
+# the corners of a rect part in the same order as Narrator.Rect
+RECT = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]]) / 2.
+
+def rotate(points, c, s):
+    # rotates every (..., 2) point by its own angle given as its cosine and sine, which have the
+    # shape of points without the last axis
+    x = points[..., 0]
+    y = points[..., 1]
+    return np.stack(((x * c) - (y * s), (y * c) + (x * s)), axis=-1)
+
+def getShape(part):
+    # the local points of a part, "points" are moved by -origin and scaled by scale, a mirrored
+    # part lists its right half and gets the left half as the reversed points with x negated
+    if "rect" in part:
+        points = RECT * part["rect"]
+    else:
+        points = np.array(part["points"], dtype=np.float64)
+        points = (points - part.get("origin", (0., 0.))) * part.get("scale", (1., 1.))
+
+    if part.get("mirror"):
+        flip = points[::-1] * (-1., 1.)
+        points = np.concatenate((flip, points))
+
+    points = np.array(points, dtype=np.float64)
+    points.setflags(write=False)
+    return points
+
+class Rig:
+    # a character as polygons in a tree of parts, every part sits at its anchor in its parent's frame,
+    # is moved from there by offset and turned by rotation, each a weight per facial field, and turns
+    # with its parent, its shape can be scaled per axis by a product of fields or be a mouth curve,
+    # see queen.json for a whole character
+    #
+    # the transforms of all parts over any number of frames are found with a handful of array operations,
+    # the shapes of all parts are flattened into one vertex buffer where every part is a range, and
+    # evaluate poses it with a python loop over the parts, one small product each
+    def __init__(self, parts, fields, name = None):
+        self.name = name
+        self.fields = tuple(fields)
+        field_index = {field: i for i, field in enumerate(self.fields)}
+
+        def getField(field):
+            if field not in field_index:
+                raise ValueError("unknown field %r" % field)
+            return field_index[field]
+
+        count = len(parts)
+        self.names = [part["name"] for part in parts]
+        index = {name: i for i, name in enumerate(self.names)}
+        if len(index) != count:
+            raise ValueError("part names must be unique")
+
+        self.colors = [tuple(part.get("color", (0, 0, 0))) for part in parts]
+        self.outlines = [float(part.get("outline", .08)) for part in parts]
+        self.shapes = []
+
+        self.parents = np.full(count, -1)
+        self.anchors = np.zeros((count, 2))
+        self.angles = np.zeros(count)
+        self.offsets = np.zeros((len(self.fields), count, 2))
+        self.turns = np.zeros((len(self.fields), count))
+
+        # the size of a part along each axis is the product of some fields, the column past the
+        # last field is always 1 and pads the products
+        factors = max([1] + [len(axis) for part in parts for axis in part.get("size", ())])
+        self.size_fields = np.full((count, 2, factors), len(self.fields))
+
+        # the mouth curves are made by the caller for every frame, as part: (width, height, smile)
+        self.mouths = {}
+
+        self.shape_fields = []
+        self.pose_fields = []
+
+        for i, part in enumerate(parts):
+            parent = part.get("parent")
+            if parent is not None:
+                if index.get(parent, count) >= i:
+                    raise ValueError("part %r has to come after its parent %r" % (part["name"], parent))
+                self.parents[i] = index[parent]
+
+            self.anchors[i] = part.get("anchor", (0., 0.))
+            self.angles[i] = part.get("angle", 0.)
+            for field, offset in part.get("offset", {}).items():
+                self.offsets[getField(field), i] = offset
+            for field, turn in part.get("rotation", {}).items():
+                self.turns[getField(field), i] = turn
+
+            shape_fields = set()
+            for axis, fields in enumerate(part.get("size", ())):
+                self.size_fields[i, axis, :len(fields)] = [getField(field) for field in fields]
+                shape_fields.update(fields)
+
+            if "mouth" in part:
+                if "size" in part:
+                    raise ValueError("the mouth %r can not have a size" % part["name"])
+                self.mouths[i] = tuple(getField(field) for field in part["mouth"])
+                shape_fields.update(part["mouth"])
+                self.shapes.append(None)
+            else:
+                self.shapes.append(getShape(part))
+
+            pose_fields = set(part.get("offset", {})) | set(part.get("rotation", {}))
+            if parent is not None:
+                pose_fields |= self.pose_fields[index[parent]]
+
+            self.shape_fields.append(shape_fields)
+            self.pose_fields.append(pose_fields)
+
+        self.offsets = self.offsets.reshape((len(self.fields), count * 2))
+
+        # ancestry[i, j] is 1 when j is i or one of its ancestors, so summing a row adds up
+        # everything a part inherits
+        self.ancestry = np.zeros((count, count))
+        for i in range(count):
+            j = i
+            while j >= 0:
+                self.ancestry[i, j] = 1.
+                j = self.parents[j]
+
+        # the fixed shapes as one vertex buffer with the range of every part, the mouths are posed
+        # on their own since their curves change every frame
+        sizes = [0 if shape is None else len(shape) for shape in self.shapes]
+        ends = np.cumsum(sizes).tolist()
+        self.ranges = [(end - size, end) for size, end in zip(sizes, ends)]
+        self.vertices = np.concatenate([shape for shape in self.shapes if shape is not None] or [np.zeros((0, 2))])
+        self.homogeneous = np.concatenate((self.vertices, np.ones((len(self.vertices), 1))), axis=1)
+
+    @classmethod
+    def load(cls, file, fields):
+        with open(file) as f:
+            data = json.load(f)
+        return cls(data["parts"], fields, data.get("name"))
+
+    def getTransforms(self, values, root = (0., 0.)):
+        # the world angle (frames, parts), position (frames, parts, 2) and size (frames, parts, 2)
+        # of every part for a (frames, fields) array of values, with the root parts at root
+        values = np.asarray(values, dtype=np.float64).reshape((-1, len(self.fields)))
+        frames = len(values)
+
+        angles = ((values @ self.turns) + self.angles) @ self.ancestry.T
+
+        # every part's local offset is turned by its parent's world angle and the offsets of
+        # a part and its ancestors add up to its position
+        local = (values @ self.offsets).reshape((frames, len(self.names), 2)) + self.anchors
+        local[:, self.parents < 0] += root
+        parents = self.parents + 1
+        c = np.concatenate((np.ones((frames, 1)), np.cos(angles)), axis=1)[:, parents]
+        s = np.concatenate((np.zeros((frames, 1)), np.sin(angles)), axis=1)[:, parents]
+        positions = np.matmul(self.ancestry, rotate(local, c, s))
+
+        padded = np.concatenate((values, np.ones((frames, 1))), axis=1)
+        sizes = padded[:, self.size_fields].prod(axis=-1)
+
+        return angles, positions, sizes
+
+    def getMouths(self, values, mouth):
+        # mouth(width, height, smile) makes the curves of every mouth part for all frames
+        return {i: mouth(values[:, width], values[:, height], values[:, smile])
+                for i, (width, height, smile) in self.mouths.items()}
+
+    def pose(self, values, root = (0., 0.), mouth = None):
+        # every part's local shape ((n, 2) when all frames share it, (frames, n, 2) otherwise),
+        # world angle and position per frame by name
+        values = np.asarray(values, dtype=np.float64).reshape((-1, len(self.fields)))
+        angles, positions, sizes = self.getTransforms(values, root)
+        shapes = self.getMouths(values, mouth)
+
+        pose = {}
+        for i, name in enumerate(self.names):
+            shape = shapes.get(i, self.shapes[i])
+            if self.shape_fields[i] and i not in self.mouths:
+                shape = shape * sizes[:, i, None]
+            pose[name] = (shape, angles[:, i], positions[:, i])
+
+        return pose
+
+    def evaluate(self, values, root = (0., 0.), mouth = None):
+        # the world space vertices of every part as (frames, n, 2) arrays by name, the fixed shapes
+        # are views into one buffer where every vertex only takes the transform of its own part, so
+        # the work grows with the vertices and not with parts times vertices
+        values = np.asarray(values, dtype=np.float64).reshape((-1, len(self.fields)))
+        angles, positions, sizes = self.getTransforms(values, root)
+        c = np.cos(angles)
+        s = np.sin(angles)
+
+        # the (frames, parts, 3, 2) affine transform of every part, rotation times size over position,
+        # which takes the part's vertices with a column of ones to world space
+        transforms = np.empty(angles.shape + (3, 2))
+        transforms[..., 0, 0] = c * sizes[..., 0]
+        transforms[..., 0, 1] = s * sizes[..., 0]
+        transforms[..., 1, 0] = -s * sizes[..., 1]
+        transforms[..., 1, 1] = c * sizes[..., 1]
+        transforms[..., 2, :] = positions
+
+        # the vertices of a part are a range of the buffer, so every part is one small product
+        vertices = np.empty((len(values), len(self.vertices), 2))
+        for i, (start, end) in enumerate(self.ranges):
+            if end > start:
+                np.matmul(self.homogeneous[start:end], transforms[:, i], out=vertices[:, start:end])
+
+        parts = {name: vertices[:, start:end] for name, (start, end) in zip(self.names, self.ranges)}
+        for i, curve in self.getMouths(values, mouth).items():
+            parts[self.names[i]] = rotate(curve, c[:, i, None], s[:, i, None]) + positions[:, i, None]
+
+        return parts
@@ -0,0 +1,154 @@
+import numpy as np
+
+from Narrator import Narrator, FACIAL_FIELDS, drawPolygon, outline_cache, poseRig, similarityScale
+
+def getMatrices(linear, angles, scales):
+    # the (instances, 2, 2) linear transforms view * scale * rotation
+    c = np.cos(angles) * scales
+    s = np.sin(angles) * scales
+    rotations = np.stack((np.stack((c, -s), axis=-1), np.stack((s, c), axis=-1)), axis=-2)
+    return np.einsum("jk,ikl->ijl", linear, rotations)
+
+def getLevels(indexes, low, high):
+    # groups the instances at indexes, in drawing order, by their (instances, 2) screen boxes low to
+    # high, an instance is a level above every instance before it that it overlaps, so no two of
+    # a level overlap and drawing the levels in order, each layer by layer over all its instances,
+    # looks as if every instance was drawn on its own
+    levels = np.zeros(len(low), dtype=np.int64)
+    for n, i in enumerate(indexes.tolist()):
+        before = indexes[:n]
+        below = before[np.all((low[before] < high[i]) & (low[i] < high[before]), axis=1)]
+        if len(below):
+            levels[i] = levels[below].max() + 1
+
+    order = indexes[np.argsort(levels[indexes], kind="stable")]
+    ends = np.cumsum(np.bincount(levels[indexes])).tolist()
+    return [order[end - size:end] for size, end in zip(np.bincount(levels[indexes]).tolist(), ends) if size]
+
+def transformInstances(shape, matrices, screen_pos):
+    if shape.ndim == 2:
+        return np.einsum("ijk,nk->inj", matrices, shape) + screen_pos[:, None]
+    return np.einsum("ijk,ink->inj", matrices, shape) + screen_pos[:, None]
+
+class Scene:
+    # many narrators sharing the parts of one template narrator, every instance only has its
+    # facial parameters, position and scale, and all instances are posed together
+    def __init__(self, template = None):
+        if template is None:
+            template = Narrator(headless = True, size = (1, 1))
+        self.template = template
+
+        self.values = np.empty((0, len(FACIAL_FIELDS)))
+        self.positions = np.empty((0, 2))
+        self.scales = np.empty(0)
+
+        self.timelines = []
+        self.offsets = np.empty(0)
+        self.interpolation = "linear"
+
+    def __len__(self):
+        return len(self.values)
+
+    def add(self, pos = (0, 0), snapshot = None, scale = 1.):
+        values = self.template.getFacialValues() if snapshot is None else snapshot.getValues()
+        self.values = np.append(self.values, [values], axis=0)
+        self.positions = np.append(self.positions, [pos], axis=0)
+        self.scales = np.append(self.scales, scale)
+        self.timelines.append(None)
+        self.offsets = np.append(self.offsets, 0.)
+
+        return len(self.values) - 1
+
+    def setSnapshot(self, i, snapshot):
+        self.values[i] = snapshot.getValues()
+
+    def setTimeline(self, i, timeline, offset = 0.):
+        self.timelines[i] = timeline
+        self.offsets[i] = offset
+
+    def seek(self, t):
+        # instances sharing a timeline are evaluated in one call
+        groups = {}
+        for i, timeline in enumerate(self.timelines):
+            if timeline is not None:
+                groups.setdefault(id(timeline), (timeline, []))[1].append(i)
+
+        for timeline, indexes in groups.values():
+            self.values[indexes] = timeline.evaluate(t + self.offsets[indexes], self.interpolation)
+
+    def pose(self, view):
+        # the local shape, screen transform and screen vertices of every part of every instance
+        linear = view[:2, :2]
+        poses = {}
+        for part, (shape, angles, positions) in poseRig(self.template, self.values).items():
+            screen_pos = (((positions * self.scales[:, None]) + self.positions) @ linear.T) + view[:2, 2]
+            matrices = getMatrices(linear, angles, self.scales)
+            poses[part] = (shape, matrices, screen_pos, transformInstances(shape, matrices, screen_pos))
+
+        return poses
+
+    def getOutlines(self, shape, matrices, screen_pos, scales, k, width):
+        # outlines are offset once per distinct shape and scale in local space and then
+        # moved onto every instance like the fills, all in one transform
+        scales = (scales * k).tolist()
+        if shape.ndim == 2 and scales.count(scales[0]) == len(scales):
+            outline = outline_cache.get(shape, width, .25 / scales[0])
+            return transformInstances(outline, matrices, screen_pos).tolist()
+
+        outlines = [outline_cache.get(shape if shape.ndim == 2 else shape[i], width, .25 / scale)
+                    for i, scale in enumerate(scales)]
+        sizes = [len(outline) for outline in outlines]
+        instances = np.repeat(np.arange(len(outlines)), sizes)
+        points = np.einsum("ijk,ik->ij", matrices[instances], np.concatenate(outlines)) + screen_pos[instances]
+
+        points = points.tolist()
+        ends = np.cumsum(sizes).tolist()
+        return [points[end - size:end] for size, end in zip(sizes, ends)]
+
+    def draw(self, viewer):
+        if len(self.values) == 0:
+            return
+
+        display = viewer.display
+        view = viewer.camera.getMatrix(display.get_size())
+        # the display no longer holds the frame a narrator's partial redraw would build on
+        viewer.view = None
+        linear = view[:2, :2]
+
+        # outline widths are in local units, the width a single narrator's outlines have at the
+        # default zoom, so they shrink and grow with the instances, k only sets the arc tolerance
+        k = similarityScale(view)
+        if k is None:
+            k = float(np.sqrt(abs(np.linalg.det(linear))))
+
+        poses = self.pose(view)
+        polys = self.template.getPolys()
+
+        # the screen box of every instance with room for its outlines, instances whose boxes miss the
+        # display are culled before anything is offset or drawn
+        low = np.min([fills.min(axis=1) for shape, matrices, screen_pos, fills in poses.values()], axis=0)
+        high = np.max([fills.max(axis=1) for shape, matrices, screen_pos, fills in poses.values()], axis=0)
+        margin = (max(poly.outline for poly in polys) * self.scales * np.abs(linear).sum(axis=1).max()) + 1.
+        low -= margin[:, None]
+        high += margin[:, None]
+
+        w, h = display.get_size()
+        visible = np.flatnonzero((high[:, 0] >= 0) & (high[:, 1] >= 0) & (low[:, 0] <= w) & (low[:, 1] <= h))
+        viewer.culled += len(self) - len(visible)
+
+        # instances that overlap are drawn in the order they were added, every level of instances that
+        # do not overlap is drawn layer by layer, the outlines of a layer first and then its fills, so
+        # every draw of a batch shares one color and no instance ends up under one added before it
+        for run in getLevels(visible, low, high):
+            for part, poly in zip(self.template.rig.names, polys):
+                shape, matrices, screen_pos, fills = poses[part]
+                if shape.ndim == 3:
+                    shape = shape[run]
+
+                if poly.outline:
+                    for outline in self.getOutlines(shape, matrices[run], screen_pos[run], self.scales[run], k, poly.outline):
+                        if len(outline) > 2:
+                            drawPolygon(display, (0, 0, 0), outline)
+
+                for points in fills[run].tolist():
+                    drawPolygon(display, poly.color, points)
@@ -0,0 +1,339 @@
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import numpy as np
+import struct
+import sys
+import time
+import timeit
+
+from Narrator import Narrator, FACIAL_FIELDS, FIELD_INDEX
+from Profiler import RollingTimer
+from Render import RawWriter, PNGWriter
+
+# every frame goes out as this header, magic, width, height, length of the encoded frame,
+# frame number and the unix time it was rendered at, followed by the encoded frame, a length
+# of 0 repeats the previous frame of the connection
+FRAME_MAGIC = b"SNFR"
+FRAME_HEADER = struct.Struct("<4sHHIQd")
+
+ENCODERS = {"raw": RawWriter.encode, "png": PNGWriter.encode}
+
+def parseCommand(line, values):
+    # "set hr=.1 sa=1.5" changes some fields and "values" followed by all 14 numbers sets every
+    # field, the new values are returned and values is left as it is
+    words = line.split()
+    values = np.array(values, dtype=np.float64)
+
+    if words[0] == "values":
+        if len(words) != len(FACIAL_FIELDS) + 1:
+            raise ValueError("values takes %d numbers" % len(FACIAL_FIELDS))
+        values[:] = [float(word) for word in words[1:]]
+
+    elif words[0] == "set":
+        for word in words[1:]:
+            name, _, value = word.partition("=")
+            if name not in FIELD_INDEX:
+                raise ValueError("unknown field %r" % name)
+            values[FIELD_INDEX[name]] = float(value)
+
+    else:
+        raise ValueError("unknown command %r" % words[0])
+
+    # nan and inf can not be drawn
+    if not np.all(np.isfinite(values)):
+        raise ValueError("values must be finite")
+
+    return values
+
+class Subscriber:
+    def __init__(self, writer, size = 2):
+        self.writer = writer
+        self.queue = asyncio.Queue(size)
+        self.sent = 0
+        self.dropped = 0
+        self.repeated = 0
+
+        # the frames are (width, height, frame number, time, image number, encoded frame), where the
+        # image number only changes when the frame does, so unchanged frames go out without their data
+        self.image = None
+
+    def push(self, frame):
+        # a slow client loses its oldest waiting frame instead of holding up the renderer or the others
+        if self.queue.full():
+            self.queue.get_nowait()
+            self.dropped += 1
+        self.queue.put_nowait(frame)
+
+    async def run(self):
+        try:
+            while True:
+                w, h, frame, t, image, data = await self.queue.get()
+                if image == self.image:
+                    self.writer.write(FRAME_HEADER.pack(FRAME_MAGIC, w, h, 0, frame, t))
+                    self.repeated += 1
+                else:
+                    self.writer.writelines((FRAME_HEADER.pack(FRAME_MAGIC, w, h, len(data), frame, t), data))
+                    self.image = image
+                await self.writer.drain()
+                self.sent += 1
+        except ConnectionError:
+            pass
+
+class NarratorServer:
+    # clients send lines of facial parameters (see parseCommand) and "subscribe" to get frames back,
+    # frames are rendered on a worker thread at up to fps from the latest parameters, updates that
+    # arrive between two frames are merged into the next one
+    def __init__(self, narrator = None, host = "127.0.0.1", port = 8765, fps = 30, format = "raw", queue_size = 2):
+        if narrator is None:
+            narrator = Narrator(headless = True)
+        self.narrator = narrator
+        self.host = host
+        self.port = port
+        self.fps = fps
+        self.encoder = ENCODERS[format]
+        self.queue_size = queue_size
+
+        self.values = np.array(narrator.getFacialValues(), dtype=np.float64)
+
+        # the time of the latest update, None until the first one
+        self.updated = None
+
+        self.subscribers = set()
+
+        # the tasks of the connected clients by their writers, so stop can close them
+        self.clients = {}
+        self.executor = ThreadPoolExecutor(1)
+        self.server = None
+        self.render_task = None
+
+        self.frames = 0
+        self.skipped = 0
+        self.errors = 0
+        self.latency = RollingTimer()
+
+        # the last rendered frame, the parameters it shows and its image number, frames are only
+        # rendered again when the parameters changed
+        self.data = None
+        self.rendered_values = None
+        self.images = 0
+
+    def setValues(self, values):
+        self.values = np.array(values, dtype=np.float64).reshape(len(FACIAL_FIELDS))
+        self.updated = timeit.default_timer()
+
+    def renderFrame(self, values):
+        # runs on the worker thread, the encoded frame is copied out since the display is reused,
+        # returns None when the frame did not change
+        narrator = self.narrator
+        narrator.setFacialValues(values.tolist())
+        narrator.update()
+        if narrator.draw() == [] and self.data is not None:
+            return None
+        return bytes(self.encoder(narrator.viewer.display))
+
+    async def handleClient(self, reader, writer):
+        subscriber = None
+        task = None
+        self.clients[writer] = asyncio.current_task()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+
+                line = line.decode(errors="replace").strip()
+                if not line:
+                    continue
+
+                if line == "subscribe":
+                    if subscriber is None:
+                        subscriber = Subscriber(writer, self.queue_size)
+                        self.subscribers.add(subscriber)
+                        task = asyncio.ensure_future(subscriber.run())
+                    continue
+
+                try:
+                    self.setValues(parseCommand(line, self.values))
+                except ValueError as e:
+                    # errors would corrupt a subscriber's frame stream, so only senders are told
+                    if subscriber is None:
+                        writer.write(("error %s\n" % e).encode())
+        except ConnectionError:
+            pass
+        finally:
+            self.clients.pop(writer, None)
+            if subscriber is not None:
+                self.subscribers.discard(subscriber)
+                task.cancel()
+            writer.close()
+
+    async def renderLoop(self):
+        loop = asyncio.get_running_loop()
+        frame_time = 1. / self.fps
+        size = self.narrator.viewer.display.get_size()
+        deadline = loop.time()
+        rendered = None
+
+        while True:
+            if self.subscribers:
+                values = self.values
+                updated = self.updated
+
+                # unchanged parameters, e.g. in a pause, send the last frame again without rendering
+                if self.rendered_values is None or not np.array_equal(values, self.rendered_values, equal_nan=True):
+                    # a frame that fails to render is counted and left out, the loop goes on
+                    # with the last frame until the parameters change again
+                    try:
+                        data = await loop.run_in_executor(self.executor, self.renderFrame, values)
+                    except Exception as e:
+                        print("frame %d failed: %r" % (self.frames, e))
+                        self.errors += 1
+                        data = None
+                        # the failed draw may have left the display half done
+                        self.narrator.viewer.view = None
+                    self.rendered_values = values
+                    if data is not None:
+                        self.data = data
+                        self.images += 1
+
+                # nothing goes out until a first frame rendered
+                if self.data is not None:
+                    frame = (size[0], size[1], self.frames, time.time(), self.images, self.data)
+                    for subscriber in list(self.subscribers):
+                        subscriber.push(frame)
+
+                    # the time from an update to the first frame showing it
+                    if updated is not None and updated != rendered:
+                        self.latency.add(timeit.default_timer() - updated)
+                        rendered = updated
+                    self.frames += 1
+
+            # a frame that took too long skips the ticks it missed instead of rendering them late,
+            # so the frames never lag further behind the parameters than one frame
+            deadline += frame_time
+            now = loop.time()
+            if now > deadline:
+                missed = int((now - deadline) / frame_time)
+                self.skipped += missed
+                deadline += missed * frame_time
+            await asyncio.sleep(max(0., deadline - now))
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handleClient, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.render_task = asyncio.ensure_future(self.renderLoop())
+        return self
+
+    async def stop(self):
+        self.render_task.cancel()
+        self.server.close()
+
+        # closing a client's writer ends its readline, so its task finishes on its own, a cancelled
+        # client task would be reported by asyncio's stream callback, so it is only cancelled when
+        # it does not finish in time
+        clients = list(self.clients.values())
+        for writer in list(self.clients):
+            writer.close()
+        await asyncio.gather(self.render_task, return_exceptions=True)
+        if clients:
+            done, pending = await asyncio.wait(clients, timeout=1.)
+            for task in pending:
+                task.cancel()
+
+        await self.server.wait_closed()
+        self.executor.shutdown()
+
+    async def serve(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    def getStats(self):
+        return {"frames": self.frames,
+                "skipped": self.skipped,
+                "subscribers": len(self.subscribers),
+                "sent": sum(subscriber.sent for subscriber in self.subscribers),
+                "dropped": sum(subscriber.dropped for subscriber in self.subscribers),
+                "repeated": sum(subscriber.repeated for subscriber in self.subscribers),
+                "errors": self.errors,
+                "latency": self.latency.getStats()}
+
+async def readFrames(reader):
+    # the frames of a subscribed connection as (frame number, time, width, height, encoded frame),
+    # a repeated frame is the same bytes object as the one before it
+    data = None
+    while True:
+        header = await reader.readexactly(FRAME_HEADER.size)
+        magic, w, h, length, frame, t = FRAME_HEADER.unpack(header)
+        if magic != FRAME_MAGIC:
+            raise ValueError("not a narrator frame stream")
+        if length:
+            data = await reader.readexactly(length)
+        elif data is None:
+            raise ValueError("a repeated frame before any frame")
+        yield frame, t, w, h, data
+
+async def roundTrip(size = (160, 120), frames = 30, backend = "numpy"):
+    # serves a narrator on a free localhost port, a client sets some fields, subscribes and reads
+    # frames raw frames, returns the problems found, the last frame has to equal a fresh render of
+    # the values and a line of nan has to be answered with an error
+    problems = []
+    line = "set hr=.2 sa=1.5 reo=.4"
+    values = parseCommand(line, Narrator(headless = True, size = size, backend = backend).getFacialValues())
+
+    server = await NarratorServer(Narrator(headless = True, size = size, backend = backend), port = 0, fps = 120).start()
+    try:
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+        writer.write(b"set hr=nan\n")
+        reply = await asyncio.wait_for(reader.readline(), 5.)
+        if not reply.startswith(b"error"):
+            problems.append("nan was not rejected: %r" % reply)
+
+        writer.write(("%s\nsubscribe\n" % line).encode())
+        await writer.drain()
+
+        received = []
+        stream = readFrames(reader)
+        while len(received) < frames:
+            received.append(await asyncio.wait_for(stream.__anext__(), 5.))
+        writer.close()
+
+        numbers = [frame for frame, t, w, h, data in received]
+        if numbers != sorted(numbers):
+            problems.append("frames out of order")
+        if any((w, h) != tuple(size) or len(data) != size[0] * size[1] * 3 for frame, t, w, h, data in received):
+            problems.append("frames of the wrong size")
+
+        expected = Narrator(headless = True, size = size, backend = backend)
+        expected.setFacialValues(values.tolist())
+        expected.update()
+        expected.draw()
+        if received[-1][4] != bytes(RawWriter.encode(expected.viewer.display)):
+            problems.append("the last frame does not show the values that were set")
+
+        stats = server.getStats()
+        if stats["errors"]:
+            problems.append("%d frames failed to render" % stats["errors"])
+    finally:
+        await server.stop()
+
+    return problems
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog = "server", description = "localhost round trip check of the narrator server")
+    parser.add_argument("-n", "--frames", type = int, default = 30, help = "frames to read")
+    parser.add_argument("-b", "--backend", choices = ("pygame", "numpy"), default = "numpy")
+    args = parser.parse_args(args)
+
+    start = timeit.default_timer()
+    problems = asyncio.run(roundTrip(frames = args.frames, backend = args.backend))
+    for problem in problems:
+        print(problem)
+    print("%d problems in %.2fs" % (len(problems), timeit.default_timer() - start))
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
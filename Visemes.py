@@ -0,0 +1,219 @@
+from collections import OrderedDict
+import numpy as np
+import re
+
+from Narrator import FACIAL_FIELDS, FIELD_INDEX, Timeline
+
+# spelling rules for english, the longest grapheme matching at a position wins, the phonemes are
+# arpabet and a few letters are handled in getPhonemes since they depend on their neighbours
+GRAPHEMES = {"tch": ("CH",), "igh": ("AY",), "ough": ("OW",), "augh": ("AO",), "eigh": ("EY",),
+             "th": ("TH",), "sh": ("SH",), "ch": ("CH",), "ph": ("F",), "wh": ("W",), "ck": ("K",),
+             "ng": ("NG",), "qu": ("K", "W"), "wr": ("R",), "gh": (), "ee": ("IY",), "ea": ("IY",),
+             "oo": ("UW",), "ou": ("AW",), "ow": ("OW",), "ai": ("EY",), "ay": ("EY",), "oa": ("OW",),
+             "oi": ("OY",), "oy": ("OY",), "au": ("AO",), "aw": ("AO",), "ew": ("UW",), "ie": ("IY",),
+             "ei": ("EY",), "ey": ("EY",), "ue": ("UW",), "ar": ("AA", "R"), "er": ("ER",), "ir": ("ER",),
+             "ur": ("ER",), "or": ("AO", "R"), "a": ("AE",), "b": ("B",), "d": ("D",), "e": ("EH",),
+             "f": ("F",), "g": ("G",), "h": ("HH",), "i": ("IH",), "j": ("JH",), "k": ("K",), "l": ("L",),
+             "m": ("M",), "n": ("N",), "o": ("AA",), "p": ("P",), "q": ("K",), "r": ("R",), "s": ("S",),
+             "t": ("T",), "u": ("AH",), "v": ("V",), "w": ("W",), "x": ("K", "S"), "z": ("Z",)}
+
+GRAPHEME_LENGTHS = sorted({len(grapheme) for grapheme in GRAPHEMES}, reverse=True)
+
+# diphthongs are two mouth shapes
+PHONEME_VISEMES = {"P": ("PP",), "B": ("PP",), "M": ("PP",), "F": ("FF",), "V": ("FF",),
+                   "TH": ("TH",), "DH": ("TH",), "T": ("DD",), "D": ("DD",), "N": ("DD",), "L": ("DD",),
+                   "K": ("KK",), "G": ("KK",), "NG": ("KK",), "HH": ("KK",),
+                   "CH": ("CH",), "JH": ("CH",), "SH": ("CH",), "ZH": ("CH",), "S": ("SS",), "Z": ("SS",),
+                   "R": ("RR",), "ER": ("RR",), "Y": ("I",),
+                   "AA": ("aa",), "AE": ("aa",), "AH": ("aa",), "AO": ("O",), "EH": ("E",),
+                   "IH": ("I",), "IY": ("I",), "UW": ("U",), "UH": ("U",), "W": ("U",),
+                   "AY": ("aa", "I"), "AW": ("aa", "U"), "OY": ("O", "I"), "EY": ("E", "I"), "OW": ("O", "U")}
+
+# the fields every viseme sets, the others keep their neutral values
+VISEMES = {"rest": {},
+           "PP": {"mw": .28, "mh": .05, "sa": 0.},
+           "FF": {"mw": .3, "mh": .08, "sa": -.5},
+           "TH": {"mw": .3, "mh": .1, "sa": 0.},
+           "DD": {"mw": .32, "mh": .12, "sa": .2},
+           "KK": {"mw": .3, "mh": .15, "sa": 0.},
+           "CH": {"mw": .24, "mh": .14, "sa": -.2},
+           "SS": {"mw": .36, "mh": .08, "sa": .5},
+           "RR": {"mw": .22, "mh": .12, "sa": -.3},
+           "aa": {"mw": .34, "mh": .35, "sa": .2, "reo": 1.1, "leo": 1.1},
+           "E": {"mw": .38, "mh": .22, "sa": .6},
+           "I": {"mw": .4, "mh": .12, "sa": 1., "reo": .9, "leo": .9},
+           "O": {"mw": .22, "mh": .3, "sa": -.4, "reo": 1.05, "leo": 1.05},
+           "U": {"mw": .16, "mh": .16, "sa": -.6}}
+
+VOWELS = "aeiou"
+
+# vowels are held about twice as long as consonants
+VOWEL_VISEMES = {"aa", "E", "I", "O", "U"}
+
+def getPhonemes(word):
+    # a rule based guess at the pronunciation of a lower case word
+    phonemes = []
+    i = 0
+    while i < len(word):
+        for length in GRAPHEME_LENGTHS:
+            grapheme = word[i:i + length]
+            if length > 1 and len(grapheme) == length and grapheme in GRAPHEMES:
+                phonemes.extend(GRAPHEMES[grapheme])
+                i += length
+                break
+        else:
+            c = word[i]
+            following = word[i + 1:i + 2]
+            if c == "e" and i == len(word) - 1 and i >= 2 and word[i - 1] not in VOWELS and word[i - 2] in VOWELS:
+                # the silent e of make and time
+                pass
+            elif c == "o" and i == len(word) - 1:
+                phonemes.append("OW")
+            elif c == "c":
+                phonemes.append("S" if following in ("e", "i", "y") else "K")
+            elif c == "y":
+                phonemes.append("Y" if i == 0 else "IY")
+            elif c == "k" and following == "n" and i == 0:
+                pass
+            elif c in GRAPHEMES:
+                phonemes.extend(GRAPHEMES[c])
+            i += 1
+
+        # doubled consonants are one sound
+        if 0 < i < len(word) and word[i] == word[i - 1] and word[i] not in VOWELS:
+            i += 1
+
+    return phonemes
+
+def getVisemes(word):
+    visemes = []
+    for phoneme in getPhonemes(word):
+        for viseme in PHONEME_VISEMES[phoneme]:
+            if not visemes or visemes[-1] != viseme:
+                visemes.append(viseme)
+    return visemes
+
+def readTimedWords(lines):
+    # "start end text" lines, e.g. from a forced aligner, a line with several words splits its time
+    # by their lengths, lines starting with # are comments
+    for line in lines:
+        parts = line.split(None, 2)
+        if len(parts) < 3 or parts[0].startswith("#"):
+            continue
+
+        start, end = float(parts[0]), float(parts[1])
+        words = parts[2].split()
+        sizes = np.array([len(word) for word in words], dtype=np.float64)
+        edges = start + ((end - start) * np.concatenate(([0.], np.cumsum(sizes))) / sizes.sum())
+        for word, word_start, word_end in zip(words, edges[:-1].tolist(), edges[1:].tolist()):
+            yield word_start, word_end, word
+
+def timeWords(lines, rate = 14., pause = .3, start = 0.):
+    # untimed text read at rate letters per second, with a pause after punctuation
+    t = start
+    for line in lines:
+        for word in line.split():
+            duration = max(1, len(word)) / rate
+            yield t, t + duration, word
+            t += duration + (pause if word[-1] in ".,;:!?" else .05)
+
+class VisemeCompiler:
+    # turns timed words into keyframes, every distinct word is spelled out into visemes and their
+    # keyframe rows once and kept in an lru cache, so common words cost a lookup and a few array ops
+    def __init__(self, neutral, cache_size = 4096, ramp = .06, pause = .2):
+        self.neutral = np.array(neutral, dtype=np.float64).reshape(len(FACIAL_FIELDS))
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+        # the mouth goes back to rest ramp seconds around silences longer than pause
+        self.ramp = ramp
+        self.pause = pause
+
+        self.rows = {}
+        for name, fields in VISEMES.items():
+            row = self.neutral.copy()
+            for field, value in fields.items():
+                row[FIELD_INDEX[field]] = value
+            self.rows[name] = row
+        self.rest = self.rows["rest"]
+
+    def getWord(self, word):
+        # where each keyframe of the word is as a share of its duration and the keyframe values
+        entry = self.cache.get(word)
+        if entry is not None:
+            self.cache.move_to_end(word)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        visemes = getVisemes(re.sub("[^a-z]", "", word.lower())) or ["rest"]
+        weights = np.array([2. if viseme in VOWEL_VISEMES else 1. for viseme in visemes])
+        ends = np.cumsum(weights) / weights.sum()
+        entry = (ends - (weights / weights.sum() / 2), np.array([self.rows[viseme] for viseme in visemes]))
+
+        self.cache[word] = entry
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+        return entry
+
+    def getChunk(self, starts, durations, entries):
+        # the keyframes of a chunk of words, every word's shares are scaled to its duration in one go
+        counts = [len(shares) for shares, rows in entries]
+        shares = np.concatenate([shares for shares, rows in entries])
+        times = np.repeat(starts, counts) + (shares * np.repeat(durations, counts))
+        return times, np.concatenate([rows for shares, rows in entries])
+
+    def compile(self, words, chunk = 1024):
+        # yields the keyframes of chunk words at a time as sorted (times, values) arrays,
+        # words are (start, end, word) in order as given by readTimedWords or timeWords
+        rest = (np.zeros(1), self.rest[None])
+        starts = []
+        durations = []
+        entries = []
+        last = None
+
+        for start, end, word in words:
+            # overlapping words are moved after the previous one so the keyframes stay sorted
+            if last is not None and start < last:
+                end += last - start
+                start = last
+
+            # rest keyframes are words of no duration
+            if last is None:
+                starts.append(max(start - self.ramp, 0.))
+                durations.append(0.)
+                entries.append(rest)
+            elif start - last >= self.pause:
+                ramp = min(self.ramp, (start - last) / 2)
+                starts += [last + ramp, start - ramp]
+                durations += [0., 0.]
+                entries += [rest, rest]
+
+            starts.append(start)
+            durations.append(end - start)
+            entries.append(self.getWord(word))
+            last = end if end > start else start
+
+            if len(entries) >= chunk:
+                yield self.getChunk(starts, durations, entries)
+                starts = []
+                durations = []
+                entries = []
+
+        if last is not None:
+            starts.append(last + self.ramp)
+            durations.append(0.)
+            entries.append(rest)
+        if entries:
+            yield self.getChunk(starts, durations, entries)
+
+def compileTimeline(words, neutral, out = None):
+    # the keyframes of words as a Timeline, or streamed into out, a Narrator.TimelineWriter
+    compiler = VisemeCompiler(neutral)
+    timeline = Timeline() if out is None else out
+    for times, values in compiler.compile(words):
+        timeline.extend(values, times)
+    return timeline